@@ -1,16 +1,99 @@
 import sys
 import os
 import subprocess
-import importlib
 import time
 import base64
+import logging
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
+
+if __name__ == "__main__" and sys.argv[1:2] in (["merge"], ["bench-startup"]):
+    # 命令行模式（python FmA.py merge ...）：不加载 PyQt5，直接调用合并引擎。
+    # 把引擎模块设为主模块，多进程解析时子进程也不会导入界面代码。
+    import fma_engine
+    sys.modules["__main__"] = fma_engine
+    sys.exit(fma_engine.cli_main(sys.argv[1:]))
+
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QFileDialog, QComboBox,
-                             QCheckBox, QProgressBar, QTextEdit, QMessageBox, QFrame,
-                             QGroupBox, QDialog)
+                             QCheckBox, QProgressBar, QPlainTextEdit, QMessageBox, QFrame,
+                             QGroupBox, QDialog, QSpinBox)
 from PyQt5.QtGui import QFont, QIcon, QPalette, QColor, QPixmap
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QSize
+
+from fma_engine import (FileMerger, MergeControl, REQUIRED_PACKAGES, DEPENDENCY_CACHE,
+                        missing_packages, probe_dependencies)
+
+# 日志面板最多显示的行数，超出后丢弃最早的行
+LOG_MAX_LINES = 5000
+# 日志刷新到界面的间隔（毫秒）
+LOG_FLUSH_INTERVAL = 100
+# 完整日志写入的滚动文件
+LOG_FILE = os.path.join(os.path.dirname(DEPENDENCY_CACHE), 'FmA.log')
+LOG_FILE_SIZE = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class LogSink:
+    """操作日志：界面批量刷新、行数有上限，完整日志写入滚动文件
+
+    消息先进入环形缓冲区，由定时器每 LOG_FLUSH_INTERVAL 毫秒一次性追加到
+    日志面板并写入日志文件；两次刷新之间超出面板行数上限的旧消息不再显示
+    （面板反正显示不下），并提示查看日志文件。
+    """
+
+    def __init__(self, widget, path=LOG_FILE):
+        self.widget = widget
+        self.widget.setMaximumBlockCount(LOG_MAX_LINES)
+        self.path = path
+        self.pending = deque(maxlen=LOG_MAX_LINES - 1)
+        self.dropped = 0
+        self.records = []
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.handler = RotatingFileHandler(path, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_BACKUPS,
+                                               encoding='utf-8', delay=True)
+            self.handler.setFormatter(logging.Formatter('%(message)s'))
+        except OSError:
+            self.handler = None
+        self.timer = QTimer()
+        self.timer.setInterval(LOG_FLUSH_INTERVAL)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def write(self, message):
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(message)
+        if self.handler:
+            self.records.append(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}")
+
+    def flush(self):
+        if self.records:
+            # 整批作为一条记录写入，文件滚动也按批判断
+            self.handler.emit(logging.makeLogRecord({'msg': "\n".join(self.records)}))
+            self.records = []
+        if not self.pending:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        if self.dropped:
+            lines.insert(0, f"... 省略 {self.dropped} 行，完整日志见 {self.path}")
+            self.dropped = 0
+        self.widget.appendPlainText("\n".join(lines))
+
+    def clear(self):
+        self.pending.clear()
+        self.dropped = 0
+        self.widget.clear()
+
+    def close(self):
+        self.timer.stop()
+        self.flush()
+        if self.handler:
+            self.handler.close()
 
 
 class DependencyChecker(QThread):
@@ -18,35 +101,26 @@ class DependencyChecker(QThread):
     progress = pyqtSignal(str)
     finished = pyqtSignal(bool)
 
-    REQUIRED_PACKAGES = [
-        'pandas',
-        'openpyxl',
-        'python-docx',
-        'chardet',
-        'psutil',
-        'xlrd'
-    ]
-
     def run(self):
         """检查并安装所需依赖"""
         self.progress.emit("正在检查依赖...")
-        missing_packages = []
 
-        # 检查所有必需包
-        for package in self.REQUIRED_PACKAGES:
-            if not self.is_package_installed(package):
-                missing_packages.append(package)
+        # 检查所有必需包（只查找，不导入），忽略缓存的结果
+        missing = probe_dependencies(refresh=True)
 
-        if not missing_packages:
+        if not missing:
             self.progress.emit("所有依赖已安装")
             self.finished.emit(True)
             return
 
-        self.progress.emit(f"缺少依赖: {', '.join(missing_packages)}")
+        self.progress.emit(f"缺少依赖: {', '.join(missing)}")
         self.progress.emit("正在尝试安装...")
 
         # 尝试安装缺失包
-        success = self.install_packages(missing_packages)
+        success = self.install_packages(missing)
+        if success:
+            # 安装后重新检查并更新缓存
+            success = not probe_dependencies(refresh=True)
 
         if success:
             self.progress.emit("依赖安装成功!")
@@ -56,12 +130,9 @@ class DependencyChecker(QThread):
             self.finished.emit(False)
 
     def is_package_installed(self, package_name):
-        """检查包是否已安装"""
-        try:
-            importlib.import_module(package_name)
-            return True
-        except ImportError:
-            return False
+        """检查包是否已安装（按 pip 包名）"""
+        module = REQUIRED_PACKAGES.get(package_name, package_name)
+        return not missing_packages({package_name: module})
 
     def install_packages(self, packages):
         """安装指定的包"""
@@ -157,6 +228,8 @@ class FmAUI(QMainWindow):
 
     def __init__(self):
         super().__init__()
+        self.fm = FileMerger()
+        self.dependencies_ok = False
         self.init_ui()
         self.setWindowTitle("FmA 文件合并助手")
         self.setGeometry(100, 100, 800, 700)
@@ -276,10 +349,9 @@ class FmAUI(QMainWindow):
 
         return title_layout
 
-    def create_input_output_group(self):
-        """创建输入输出分组"""
-        group = QGroupBox("文件路径")
-        group.setStyleSheet("""
+    def group_style(self):
+        """分组框通用样式"""
+        return """
             QGroupBox {
                 font-size: 14px;
                 font-weight: 500;
@@ -294,7 +366,12 @@ class FmAUI(QMainWindow):
                 left: 10px;
                 padding: 0 5px;
             }
-        """)
+        """
+
+    def create_input_output_group(self):
+        """创建输入输出分组"""
+        group = QGroupBox("文件路径")
+        group.setStyleSheet(self.group_style())
 
         layout = QVBoxLayout()
         layout.setSpacing(12)
@@ -335,8 +412,13 @@ class FmAUI(QMainWindow):
         """)
         input_btn.clicked.connect(self.select_input)
 
+        input_dir_btn = QPushButton("文件夹")
+        input_dir_btn.setStyleSheet(input_btn.styleSheet())
+        input_dir_btn.clicked.connect(self.select_input_dir)
+
         input_layout.addWidget(self.input_path)
         input_layout.addWidget(input_btn)
+        input_layout.addWidget(input_dir_btn)
 
         # 输出路径
         output_layout = QHBoxLayout()
@@ -362,7 +444,7 @@ class FmAUI(QMainWindow):
     def create_options_group(self):
         """创建选项分组"""
         group = QGroupBox("合并选项")
-        group.setStyleSheet(self.create_input_output_group().styleSheet())
+        group.setStyleSheet(self.group_style())
         group.setMaximumHeight(120)
 
         layout = QVBoxLayout()
@@ -378,7 +460,7 @@ class FmAUI(QMainWindow):
         format_label = QLabel("输出格式")
         format_label.setStyleSheet("font-size: 13px; color: #7f8c8d;")
         self.format_combo = QComboBox()
-        self.format_combo.addItems(["Excel (.xlsx)", "Word (.docx)", "JSON (.json)", "Text (.txt)"])
+        self.format_combo.addItems(["Excel (.xlsx)", "Word (.docx)", "JSON (.json)", "JSON Lines (.jsonl)", "Text (.txt)"])
         self.format_combo.setStyleSheet("""
             QComboBox {
                 padding: 6px;
@@ -407,9 +489,69 @@ class FmAUI(QMainWindow):
         self.recursive_cb.setChecked(True)
         self.recursive_cb.setStyleSheet(self.add_source_cb.styleSheet())
 
+        # 增量合并（只重新读取变化的文件）
+        self.incremental_cb = QCheckBox("增量合并")
+        self.incremental_cb.setChecked(False)
+        self.incremental_cb.setToolTip("缓存本次解析结果，下次只重新读取有变化的文件")
+        self.incremental_cb.setStyleSheet(self.add_source_cb.styleSheet())
+
+        # 文本/日志内容按时间戳排序
+        self.sort_cb = QCheckBox("按时间排序")
+        self.sort_cb.setChecked(False)
+        self.sort_cb.setToolTip("文本与日志文件的内容按行首时间戳（如 2023-01-01 12:00:00）合并排序")
+        self.sort_cb.setStyleSheet(self.add_source_cb.styleSheet())
+
+        # 断点续传：中断后再次合并时跳过已处理的文件。文本/JSON Lines 输出可直接
+        # 续写，默认勾选；其他格式续传要额外写一份日志，默认不勾选
+        self.resume_cb = QCheckBox("断点续传")
+        self.resume_cb.setChecked(self.get_output_format() in ('text', 'jsonl'))
+        self.resume_cb.setToolTip("中断或取消后再次合并相同的输入与输出时，从中断处继续；取消勾选则总是重新开始。"
+                                  "Excel、JSON、Word 输出续传需要把数据另写一份日志，合并较慢")
+        self.format_combo.currentIndexChanged.connect(
+            lambda: self.resume_cb.setChecked(self.get_output_format() in ('text', 'jsonl')))
+        self.resume_cb.setStyleSheet(self.add_source_cb.styleSheet())
+
+        # 跨文件去除重复行
+        self.dedup_cb = QCheckBox("去除重复行")
+        self.dedup_cb.setChecked(False)
+        self.dedup_cb.setToolTip("内容完全相同的表格行、文本行与 JSON 元素只保留第一次出现的")
+        self.dedup_cb.setStyleSheet(self.add_source_cb.styleSheet())
+
+        # 合并后读回输出核对行数与校验和
+        self.verify_cb = QCheckBox("校验完整性")
+        self.verify_cb.setChecked(False)
+        self.verify_cb.setToolTip("合并后读回输出，按来源文件核对行数与校验和（支持 Excel、JSON、JSON Lines 输出）")
+        self.verify_cb.setStyleSheet(self.add_source_cb.styleSheet())
+
+        # 并行进程数（1 为串行模式）
+        workers_layout = QVBoxLayout()
+        workers_label = QLabel("并行进程")
+        workers_label.setStyleSheet(format_label.styleSheet())
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(min(os.cpu_count() or 1, 8))
+        self.workers_spin.setToolTip("解析输入文件的进程数，设为 1 时串行处理")
+        self.workers_spin.setStyleSheet("""
+            QSpinBox {
+                padding: 6px;
+                border: 1px solid #dcdee2;
+                border-radius: 4px;
+                font-size: 14px;
+            }
+        """)
+
+        workers_layout.addWidget(workers_label)
+        workers_layout.addWidget(self.workers_spin)
+
         options_row1.addLayout(format_layout)
         options_row1.addWidget(self.add_source_cb)
         options_row1.addWidget(self.recursive_cb)
+        options_row1.addWidget(self.incremental_cb)
+        options_row1.addWidget(self.sort_cb)
+        options_row1.addWidget(self.resume_cb)
+        options_row1.addWidget(self.dedup_cb)
+        options_row1.addWidget(self.verify_cb)
+        options_row1.addLayout(workers_layout)
 
         layout.addLayout(options_row1)
         group.setLayout(layout)
@@ -419,7 +561,7 @@ class FmAUI(QMainWindow):
     def create_progress_group(self):
         """创建进度分组"""
         group = QGroupBox()
-        group.setStyleSheet(self.create_input_output_group().styleSheet())
+        group.setStyleSheet(self.group_style())
 
         layout = QVBoxLayout()
         layout.setContentsMargins(15, 15, 15, 15)
@@ -447,8 +589,14 @@ class FmAUI(QMainWindow):
         self.progress_label.setStyleSheet("font-size: 13px; color: #7f8c8d; padding-top: 8px;")
         self.progress_label.setAlignment(Qt.AlignCenter)
 
+        # 运行指标（内存、吞吐量、阶段、剩余时间）
+        self.metrics_label = QLabel("")
+        self.metrics_label.setStyleSheet("font-size: 12px; color: #95a5a6;")
+        self.metrics_label.setAlignment(Qt.AlignCenter)
+
         layout.addWidget(self.progress_bar)
         layout.addWidget(self.progress_label)
+        layout.addWidget(self.metrics_label)
         group.setLayout(layout)
 
         return group
@@ -456,16 +604,17 @@ class FmAUI(QMainWindow):
     def create_log_group(self):
         """创建日志分组（增加高度）"""
         group = QGroupBox("操作日志")
-        group.setStyleSheet(self.create_input_output_group().styleSheet())
+        group.setStyleSheet(self.group_style())
 
         layout = QVBoxLayout()
         layout.setContentsMargins(15, 15, 15, 15)
 
         # 日志文本框 - 增加高度
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_sink = LogSink(self.log_text)
         self.log_text.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 border: 1px solid #dcdee2;
                 border-radius: 4px;
                 background-color: white;
@@ -491,7 +640,7 @@ class FmAUI(QMainWindow):
                 background-color: #d0d3d4;
             }
         """)
-        clear_btn.clicked.connect(self.log_text.clear)
+        clear_btn.clicked.connect(self.log_sink.clear)
 
         layout.addWidget(self.log_text)
         layout.addWidget(clear_btn, 0, Qt.AlignRight)
@@ -527,6 +676,37 @@ class FmAUI(QMainWindow):
         self.merge_btn.setCursor(Qt.PointingHandCursor)
         self.merge_btn.clicked.connect(self.start_merge)
 
+        # 暂停/取消按钮：仅在合并进行中可用
+        control_style = """
+            QPushButton {
+                background-color: #ecf0f1;
+                color: #34495e;
+                font-weight: 500;
+                font-size: 15px;
+                border: none;
+                border-radius: 6px;
+                padding: 12px 25px;
+                min-width: 80px;
+            }
+            QPushButton:hover {
+                background-color: #d0d3d4;
+            }
+            QPushButton:disabled {
+                color: #bdc3c7;
+            }
+        """
+        self.pause_btn = QPushButton("暂停")
+        self.pause_btn.setStyleSheet(control_style)
+        self.pause_btn.setCursor(Qt.PointingHandCursor)
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.clicked.connect(self.toggle_pause)
+
+        self.cancel_btn = QPushButton("取消")
+        self.cancel_btn.setStyleSheet(control_style)
+        self.cancel_btn.setCursor(Qt.PointingHandCursor)
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_merge)
+
         # 退出按钮
         exit_btn = QPushButton("退出程序")
         exit_btn.setStyleSheet("""
@@ -550,6 +730,10 @@ class FmAUI(QMainWindow):
         button_layout.addStretch()
         button_layout.addWidget(self.merge_btn)
         button_layout.addSpacing(15)
+        button_layout.addWidget(self.pause_btn)
+        button_layout.addSpacing(15)
+        button_layout.addWidget(self.cancel_btn)
+        button_layout.addSpacing(15)
         button_layout.addWidget(exit_btn)
         button_layout.addStretch()
 
@@ -574,11 +758,25 @@ class FmAUI(QMainWindow):
                 # 更新进度状态
                 self.progress_label.setText("已选择输入文件")
 
+    def select_input_dir(self):
+        """选择输入文件夹"""
+        path = QFileDialog.getExistingDirectory(self, "选择输入文件夹", "")
+
+        if path:
+            self.input_path.setText(path)
+
+            # 自动设置输出路径（扫描时会排除输出文件本身）
+            if not self.output_path.text():
+                output_file = os.path.join(path, "合并结果.xlsx")
+                self.output_path.setText(output_file)
+
+            self.progress_label.setText("已选择输入文件夹")
+
     def select_output(self):
         """选择输出文件路径"""
         path, _ = QFileDialog.getSaveFileName(
             self, "选择输出文件", "",
-            "Excel文件 (*.xlsx);;Word文件 (*.docx);;JSON文件 (*.json);;文本文件 (*.txt)"
+            "Excel文件 (*.xlsx);;Word文件 (*.docx);;JSON文件 (*.json);;JSON Lines文件 (*.jsonl);;文本文件 (*.txt)"
         )
 
         if path:
@@ -603,29 +801,39 @@ class FmAUI(QMainWindow):
         settings = {
             'add_source': self.add_source_cb.isChecked(),
             'recursive': self.recursive_cb.isChecked(),
+            'incremental': self.incremental_cb.isChecked(),
+            'resume': self.resume_cb.isChecked(),
+            'sort_by_time': self.sort_cb.isChecked(),
+            'dedup': self.dedup_cb.isChecked(),
+            'verify': self.verify_cb.isChecked(),
+            'workers': self.workers_spin.value(),
             'combine_sheets': True,  # 默认只显示一个选项
             'output_format': self.get_output_format()
         }
 
         # 更新UI状态
         self.progress_bar.setValue(0)
-        self.log_text.clear()
+        self.metrics_label.setText("")
+        self.log_sink.clear()
         self.progress_label.setText("开始处理文件...")
         self.merge_btn.setEnabled(False)
+        self.pause_btn.setText("暂停")
+        self.pause_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(True)
 
         # 记录开始时间
-        self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] 开始合并操作")
-        self.log_text.append(f"输入: {input_path}")
-        self.log_text.append(f"输出: {output_file}")
-        self.log_text.append("-" * 40)
+        self.log_sink.write(f"[{datetime.now().strftime('%H:%M:%S')}] 开始合并操作")
+        self.log_sink.write(f"输入: {input_path}")
+        self.log_sink.write(f"输出: {output_file}")
+        self.log_sink.write("-" * 40)
 
         # 创建并启动合并线程
         self.merge_thread = MergeThread(
             self.fm, input_path, output_file, settings
         )
-        self.merge_thread.log.connect(self.log_text.append)
+        self.merge_thread.log.connect(self.log_sink.write)
         self.merge_thread.finished.connect(self.merge_finished)
-        self.merge_thread.file_processed.connect(self.update_progress)
+        self.merge_thread.metrics.connect(self.update_metrics)
         self.merge_thread.start()
 
     def get_output_format(self):
@@ -635,30 +843,88 @@ class FmAUI(QMainWindow):
             return "excel"
         elif "Word" in format_text:
             return "word"
+        elif "JSON Lines" in format_text:
+            return "jsonl"
         elif "JSON" in format_text:
             return "json"
         else:
             return "text"
 
-    def update_progress(self, filename, count):
-        """更新进度显示"""
-        # 进度值是一个0-100的整数
-        progress = min(count * 10, 100)  # 简单的进度计算，每处理一个文件增加10%
-        self.progress_bar.setValue(progress)
-        self.progress_label.setText(f"正在处理: {filename}")
+    def toggle_pause(self):
+        """暂停或继续合并；暂停期间不再读取新文件，释放 CPU"""
+        control = self.merge_thread.control
+        if control.paused:
+            control.resume()
+            self.pause_btn.setText("暂停")
+            self.log_sink.write(f"[{datetime.now().strftime('%H:%M:%S')}] 继续合并")
+        else:
+            control.pause()
+            self.pause_btn.setText("继续")
+            self.log_sink.write(f"[{datetime.now().strftime('%H:%M:%S')}] 已暂停")
+
+    def cancel_merge(self):
+        """取消合并；当前文件处理到数据块边界后停止"""
+        self.merge_thread.control.cancel()
+        self.pause_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+        self.progress_label.setText("正在取消...")
+
+    def update_progress(self, metrics):
+        """按已处理字节数更新进度条；输入总量统计完成前显示为忙碌状态"""
+        if metrics['progress'] is None:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, 100)
+            self.progress_bar.setValue(int(metrics['progress'] * 100))
+        if metrics['current']:
+            self.progress_label.setText(f"正在处理: {metrics['current']}")
+
+    def update_metrics(self, metrics):
+        """显示运行指标（引擎已按固定频率节流）"""
+        self.update_progress(metrics)
+        parts = [f"阶段: {metrics['stage']}"]
+        if metrics['rss'] is not None:
+            parts.append(f"内存 {metrics['rss'] / 1024 / 1024:.0f} MB")
+        parts.append(f"{metrics['files_per_s']:.1f} 文件/秒")
+        parts.append(f"{metrics['mb_per_s']:.1f} MB/秒")
+        parts.append(f"{metrics['rows_per_s']:,.0f} 行/秒")
+        if metrics['eta'] is not None:
+            minutes, seconds = divmod(int(metrics['eta']), 60)
+            parts.append(f"剩余 {minutes:02d}:{seconds:02d}")
+        self.metrics_label.setText(" | ".join(parts))
 
     def merge_finished(self, success, stats):
         """合并完成处理"""
         # 恢复UI状态
         self.merge_btn.setEnabled(True)
+        self.pause_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+        self.progress_bar.setRange(0, 100)
         self.progress_label.setText("操作完成" if success else "操作失败")
 
+        if stats.get('cancelled'):
+            self.progress_label.setText("已取消")
+            if stats.get('resumable'):
+                self.log_sink.write("已处理的文件已保存，再次开始合并将从中断处继续")
+            self.log_sink.flush()
+            return
+
         if success:
-            self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] 合并成功!")
-            self.log_text.append(f"处理时间: {stats['time']:.2f}秒")
-            self.log_text.append(f"处理文件数: {stats['files']}")
-            self.log_text.append(f"成功合并: {stats['success']}")
+            self.log_sink.write(f"[{datetime.now().strftime('%H:%M:%S')}] 合并成功!")
+            self.log_sink.write(f"处理时间: {stats['time']:.2f}秒")
+            self.log_sink.write(f"处理文件数: {stats['files']}")
+            self.log_sink.write(f"成功合并: {stats['success']}")
+            metrics = stats.get('metrics')
+            if metrics:
+                self.update_metrics(metrics)
+                self.progress_label.setText("操作完成")
+                self.log_sink.write(
+                    f"吞吐量: {metrics['files_per_s']:.1f} 文件/秒 | {metrics['mb_per_s']:.1f} MB/秒 | "
+                    f"读取 {metrics['read_seconds']:.1f}秒 / 写入 {metrics['write_seconds']:.1f}秒 / "
+                    f"生成输出 {metrics['stage_seconds'].get('生成输出', 0):.1f}秒"
+                )
             self.progress_bar.setValue(100)
+            self.log_sink.flush()
 
             # 显示成功消息
             QMessageBox.information(
@@ -669,8 +935,9 @@ class FmAUI(QMainWindow):
                 f"文件数量: {stats['files']}"
             )
         else:
-            self.log_text.append(f"[{datetime.now().strftime('%H:%M:%S')}] 合并失败")
+            self.log_sink.write(f"[{datetime.now().strftime('%H:%M:%S')}] 合并失败")
             self.progress_bar.setValue(0)
+            self.log_sink.flush()
 
             # 显示错误消息
             error_msg = stats.get('error', '未知错误')
@@ -681,23 +948,30 @@ class FmAUI(QMainWindow):
 
     def check_dependencies(self):
         """检查所有依赖是否已安装"""
-        required = ['pandas', 'openpyxl', 'python-docx', 'chardet', 'psutil']
-        missing = []
+        if self.dependencies_ok:
+            return True
 
-        for package in required:
-            try:
-                importlib.import_module(package)
-            except ImportError:
-                missing.append(package)
+        # 重型模块在实际合并对应格式时才导入，这里只确认能找到；
+        # 环境未变化时直接使用磁盘上缓存的检查结果
+        if probe_dependencies():
+            # 显示依赖安装对话框
+            dialog = DependencyDialog(self)
+            if dialog.exec_() != QDialog.Accepted:
+                return False
 
-        if not missing:
-            return True
+        self.dependencies_ok = True
+        self.merge_btn.setEnabled(True)
+        return True
 
-        # 显示依赖安装对话框
-        dialog = DependencyDialog(self)
-        result = dialog.exec_()
 
-        return result == QDialog.Accepted
+    def closeEvent(self, event):
+        """关闭窗口前停止进行中的合并（保留续传状态）并写出缓冲中的日志"""
+        thread = getattr(self, 'merge_thread', None)
+        if thread is not None and thread.isRunning():
+            thread.control.cancel()
+            thread.wait()
+        self.log_sink.close()
+        super().closeEvent(event)
 
 
 class MergeThread(QThread):
@@ -705,7 +979,7 @@ class MergeThread(QThread):
     progress = pyqtSignal(int)
     finished = pyqtSignal(bool, dict)
     log = pyqtSignal(str)
-    file_processed = pyqtSignal(str, int)
+    metrics = pyqtSignal(dict)
 
     def __init__(self, fm, input_path, output_file, settings):
         super().__init__()
@@ -713,16 +987,20 @@ class MergeThread(QThread):
         self.input_path = input_path
         self.output_file = output_file
         self.settings = settings
+        self.control = MergeControl()
 
     def run(self):
         try:
             self.log.emit("开始文件合并...")
-            success, stats = self.fm.merge_files(self.input_path, self.output_file, self.settings)
+            success, stats = self.fm.merge_files(
+                self.input_path, self.output_file, self.settings,
+                log=self.log.emit, metrics=self.metrics.emit, control=self.control
+            )
 
             if success:
                 self.log.emit(f"合并成功! 输出文件: {self.output_file}")
                 self.log.emit(f"处理时间: {stats['time']:.2f}秒 | 文件数: {stats['files']} | 成功: {stats['success']}")
-            else:
+            elif not stats.get('cancelled'):
                 self.log.emit(f"合并失败: {stats}")
 
             self.finished.emit(success, stats)
@@ -752,19 +1030,8 @@ def main():
 
 
 if __name__ == "__main__":
-    # 确保正确初始化
-    import datetime
-    import glob
-    import json
-    import importlib
-
-    # 尝试导入核心模块
-    try:
-        import pandas as pd
-        from docx import Document
-        import psutil
-    except ImportError:
-        # 如果导入失败，将在依赖检查中处理
-        pass
+    # 打包为可执行文件时支持多进程解析
+    import multiprocessing
+    multiprocessing.freeze_support()
 
     main()
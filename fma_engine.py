@@ -0,0 +1,4219 @@
+"""FmA 合并引擎 - 分段流式读取输入文件并直接写入输出（不依赖 PyQt5）"""
+import os
+import sys
+import csv
+import json
+import io
+import re
+import codecs
+import time
+import mmap
+import fnmatch
+import itertools
+import pickle
+import queue
+import shutil
+import heapq
+import tempfile
+import hashlib
+import posixpath
+import zipfile
+import threading
+import multiprocessing
+from collections import deque
+from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from functools import partial
+from xml.sax.saxutils import escape as xml_escape, quoteattr
+
+
+# 运行所需的第三方包：pip 包名 -> 导入时的模块名
+REQUIRED_PACKAGES = {
+    'pandas': 'pandas',
+    'openpyxl': 'openpyxl',
+    'python-docx': 'docx',
+    'chardet': 'chardet',
+    'psutil': 'psutil',
+    'xlrd': 'xlrd',
+}
+
+# 导入开销大的模块：启动时不加载，只在实际合并对应格式时导入
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'xlrd', 'docx', 'lxml', 'chardet', 'psutil')
+
+# 依赖检查结果的缓存文件（按解释器与 site-packages 修改时间失效）
+DEPENDENCY_CACHE = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                'FmA', 'dependencies.json')
+
+# 冷启动（导入引擎并检查依赖）的时间预算，单位秒
+STARTUP_BUDGET = 0.5
+
+# 支持的输入文件类型
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv', '.txt', '.log', '.json', '.docx')
+
+# 各输出格式对应的文件扩展名（第一个为默认扩展名）
+OUTPUT_EXTENSIONS = {
+    'excel': ('.xlsx', '.xlsm'),
+    'word': ('.docx',),
+    'json': ('.json',),
+    'jsonl': ('.jsonl', '.ndjson'),
+    'text': ('.txt', '.csv', '.log'),
+}
+
+# 每个数据块的行数（表格）与行数（文本）
+CHUNK_ROWS = 5000
+TEXT_CHUNK_LINES = 10000
+
+# 增量解析 JSON 时每次读取的字符数；单个值超过缓冲区时按倍数扩大
+JSON_READ_BLOCK = 1024 * 1024
+
+# 并发列举目录的线程数
+SCAN_WORKERS = 8
+
+# 超过该大小的文件不交给进程池，由主进程流式读取
+PARALLEL_MAX_BYTES = 64 * 1024 * 1024
+
+# 断点续传清单与日志文件后缀（保存在输出文件旁）
+CHECKPOINT_SUFFIX = '.fma-checkpoint'
+JOURNAL_SUFFIX = '.fma-journal'
+
+# 编码识别的采样大小（大文件只读取开头/中间/结尾各一段），以及缓存的文件数上限
+ENCODING_SAMPLE = 64 * 1024
+ENCODING_CACHE_SIZE = 4096
+
+# chardet 置信度低于该值且采样能按 GB18030 正常解码时，按 GB18030 处理
+ENCODING_CONFIDENCE = 0.5
+
+# 识别为 UTF-8 的文件中途出现非法字节时，这些字节改按该编码解码
+FALLBACK_ENCODING = 'gb18030'
+DECODE_ERRORS = 'fma-fallback'
+
+# 文件指纹采样大小（大文件对开头/中间/结尾各采样一段）
+FINGERPRINT_SAMPLE = 256 * 1024
+
+# 不影响输出内容的运行参数，不计入断点签名
+RUNTIME_SETTINGS = ('workers', 'resume', 'incremental', 'memory_budget', 'metrics_interval')
+
+# 增量合并缓存目录后缀；影响解析结果的参数变化后缓存失效
+CACHE_SUFFIX = '.fma-cache'
+READ_SETTINGS = ('sheets', 'columns', 'chunk_rows', 'text_chunk_lines', 'strings')
+
+# 文本输出时可按原始字节直接拼接的输入类型、拷贝块大小、表头行的最大长度
+# 与拷贝时校验 UTF-8 的解码块大小
+RAW_TEXT_EXTENSIONS = ('.txt', '.log')
+RAW_CSV_EXTENSIONS = ('.csv',)
+RAW_COPY_BLOCK = 16 * 1024 * 1024
+RAW_HEADER_MAX = 1024 * 1024
+RAW_VALIDATE_BLOCK = 1024 * 1024
+
+# 按时间戳排序：参与排序的文本类型、默认时间戳格式（ISO 风格，可按字符串比较）、
+# 内存缓冲区上限（字节）、同时归并的有序段数上限、临时目录名前缀
+SORT_EXTENSIONS = ('.txt', '.log')
+TIME_PATTERN = r'(\d{4}[-/]\d{2}[-/]\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?)'
+SORT_MEMORY = 256 * 1024 * 1024
+SORT_MAX_RUNS = 256
+SORT_SUFFIX = '.fma-sort-'
+
+# 去重指纹索引在内存中的上限（字节，每行 8 字节），超出后写入该前缀的临时目录
+DEDUP_MEMORY = 256 * 1024 * 1024
+DEDUP_SUFFIX = '.fma-dedup-'
+DEDUP_MERGE_BLOCK = 1024 * 1024
+
+# 可按追加内容增量读取的文本类型
+APPENDABLE_EXTENSIONS = ('.txt', '.log')
+
+# 列式中间文件：魔数、对齐字节数、按原始缓冲区保存的 numpy 类型
+COLUMNAR_MAGIC = b'FMAC'
+COLUMNAR_ALIGN = 64
+COLUMNAR_ARRAY_KINDS = 'biufcmM'
+
+# Excel 输出的暂存目录前缀：数据块先暂存，统一表头与列类型后再写入；内存中
+# 暂存的数据超过 SPOOL_MEMORY 字节后写入暂存目录
+SPOOL_SUFFIX = '.fma-spool-'
+SPOOL_MEMORY = 16 * 1024 * 1024
+
+# 内存预算（常驻内存字节数）：超过后解析结果与暂存数据以列式帧写入磁盘
+MEMORY_BUDGET = 512 * 1024 * 1024
+SPILL_SUFFIX = '.fma-spill-'
+
+# strings='category' 时，不同值占比不超过该比例的文本列转为分类类型
+CATEGORY_MAX_RATIO = 0.5
+
+# 运行指标（含进度）回调的最小间隔（秒），即界面刷新频率
+METRICS_INTERVAL = 0.25
+PAUSED_STAGE = '已暂停'
+OUTPUT_STAGE = '生成输出'
+
+# 进度估算：关闭时才生成输出的写入器（如 Excel），生成阶段开始前按该速度
+# （行/秒）估计其耗时，开始后按实测速度
+OUTPUT_ROWS_PER_S = 20000
+
+# 完整性校验：记录哈希取 64 位，按模 2^64 求和；不超过 2^53 的整数值浮点数按整数比较
+VERIFY_MASK = (1 << 64) - 1
+VERIFY_EXACT_FLOAT = 2 ** 53
+VERIFY_LOG_MISMATCHES = 20
+VERIFY_FORMATS = ('excel', 'json', 'jsonl')
+
+# 非表格数据写入表格输出时使用的工作表名
+DEFAULT_SHEET = 'Sheet1'
+TEXT_SHEET = '文本'
+JSON_SHEET = 'JSON'
+WORD_SHEET = 'Word'
+IP_SHEET = 'IP统计'
+
+# Word 输出：WordprocessingML 命名空间（lxml 的 {uri} 前缀形式）与关系类型
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+WP = '{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+MC = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+CONTENT_TYPES = '{http://schemas.openxmlformats.org/package/2006/content-types}'
+REL_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+REL_HYPERLINK = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink'
+MEDIA_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif',
+    '.bmp': 'image/bmp', '.tif': 'image/tiff', '.tiff': 'image/tiff', '.emf': 'image/x-emf',
+    '.wmf': 'image/x-wmf', '.svg': 'image/svg+xml',
+}
+# 引用未合并部件（页眉页脚、脚注、尾注、批注、嵌入文档）的元素直接去掉
+WORD_DROPPED_ELEMENTS = {W + name for name in (
+    'headerReference', 'footerReference', 'footnoteReference', 'endnoteReference',
+    'commentReference', 'commentRangeStart', 'commentRangeEnd', 'altChunk')}
+# 关系无法合并（如图表、OLE 对象）时整体去掉的图形元素
+WORD_EMBEDDED_OBJECTS = {W + 'drawing', W + 'pict', W + 'object'}
+# 模板中不再使用的部件（Word 2010 的样式副本，合并样式后会与 styles.xml 不一致）
+WORD_DROPPED_PARTS = ('word/stylesWithEffects.xml',)
+WORD_DROPPED_TARGETS = ('stylesWithEffects.xml',)
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+XMLNS_PATTERN = re.compile(rb' xmlns:([\w.-]+)="([^"]*)"')
+XMLNS_BLOCK = re.compile(rb'<[\w.:-]+((?: xmlns:[\w.-]+="[^"]*")*)')
+
+# IP 统计：匹配 IPv4 地址的正则表达式与输出列
+IP_PATTERN = r'(?<![\d.])(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})(?![\d.])'
+IP_COLUMNS = ('IP地址', '次数')
+
+# 来源信息列；来源信息字典的最大项数
+SOURCE_COLUMNS = ('来源文件', '来源路径', '工作表', '时间戳')
+SOURCE_TAG_CACHE = 1024
+
+# Excel 限制
+INVALID_SHEET_CHARS = '[]:*?/\\'
+MAX_SHEET_NAME = 31
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+EXCEL_MAX_CELL_CHARS = 32767
+
+
+class Chunk:
+    """读取阶段产生的数据块
+
+    kind 取值:
+        table   - data 为 DataFrame，sheet 为工作表名
+        text    - data 为文本行列表
+        records - data 为 JSON 数组元素列表
+        object  - data 为顶层 JSON 对象（输出为 JSON 时深度合并）
+        doc     - data 为 (段落文本, 样式名) 列表
+        raw     - data 为 (起始偏移, 结束偏移, CSV 表头, 表头行)，文本输出直接拼接原始字节
+        docx    - data 为 .docx 文件路径，Word 输出直接合并其正文 XML
+
+    position 为读到该数据块末尾时输入文件的字节偏移（进度按数据块推进），
+    读取器无法给出时为 None。
+    """
+    __slots__ = ('kind', 'source', 'sheet', 'data', 'position')
+
+    def __init__(self, kind, source, data, sheet=None, position=None):
+        self.kind = kind
+        self.source = source
+        self.data = data
+        self.sheet = sheet
+        self.position = position
+
+    def __len__(self):
+        return 1 if self.kind in ('object', 'docx') else len(self.data)
+
+
+# ---------------------------------------------------------------------------
+# 文件发现
+# ---------------------------------------------------------------------------
+
+def scan_files(input_path, settings, exclude=(), log=None):
+    """扫描输入路径，按确定的顺序惰性产出待合并文件
+
+    基于 os.scandir；子目录的列举由线程池提前并发执行（网络共享盘上列目录
+    主要耗时在等待 I/O），产出顺序仍与逐层深度优先遍历一致：先当前目录的
+    文件（按名称排序），再依次进入各子目录。调用方边扫描边处理，不必等待
+    整个目录树列举完成。
+
+    settings 中的相关设置：
+        recursive     - 是否包含子文件夹
+        extensions    - 允许的扩展名，默认 SUPPORTED_EXTENSIONS
+        include       - 文件名或相对路径需匹配的 glob 模式之一
+        exclude       - 排除的 glob 模式（匹配的目录整个跳过）
+        scan_workers  - 并发列目录的线程数
+    """
+    log = log or (lambda message: None)
+    extensions = tuple(e.lower() for e in as_list(settings.get('extensions'))) or SUPPORTED_EXTENSIONS
+    include = as_list(settings.get('include'))
+    excluded_patterns = as_list(settings.get('exclude'))
+    excluded_paths = {os.path.abspath(p) for p in exclude}
+    excluded_names = {os.path.basename(p) for p in excluded_paths}
+    recursive = settings.get('recursive', True)
+    root = input_path
+
+    def matches(patterns, path, name):
+        if not patterns:
+            return False
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relative, p) for p in patterns)
+
+    def accept(path, name):
+        if name.startswith('~$'):  # Office 临时锁文件
+            return False
+        if not name.lower().endswith(extensions):
+            return False
+        if include and not matches(include, path, name):
+            return False
+        if matches(excluded_patterns, path, name):
+            return False
+        return name not in excluded_names or os.path.abspath(path) not in excluded_paths
+
+    if os.path.isfile(input_path):
+        root = os.path.dirname(input_path) or '.'
+        if accept(input_path, os.path.basename(input_path)):
+            yield input_path
+        return
+
+    def list_dir(path):
+        files, dirs = [], []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not matches(excluded_patterns, entry.path, entry.name):
+                                dirs.append(entry.path)
+                        elif entry.is_file() and accept(entry.path, entry.name):
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            log(f"无法读取目录 {path}: {e}")
+        return sorted(files), sorted(dirs)
+
+    pool = ThreadPoolExecutor(max(1, int(settings.get('scan_workers', SCAN_WORKERS))))
+
+    def walk(future):
+        files, dirs = future.result()
+        children = [pool.submit(list_dir, d) for d in dirs]  # 提前并发列举子目录
+        yield from files
+        for child in children:
+            yield from walk(child)
+
+    try:
+        yield from walk(pool.submit(list_dir, input_path))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------------------------------------------------------------------------
+# 编码识别
+# ---------------------------------------------------------------------------
+
+_encoding_cache = {}
+
+
+def detect_encoding(path, sample_size=ENCODING_SAMPLE):
+    """识别文本编码，结果按 (路径, 大小, 修改时间) 缓存"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    encoding = _encoding_cache.get(key)
+    if encoding is None:
+        if len(_encoding_cache) >= ENCODING_CACHE_SIZE:
+            _encoding_cache.clear()
+        encoding = _encoding_cache[key] = _detect_encoding(path, st.st_size, sample_size)
+    return encoding
+
+
+def _detect_encoding(path, size, sample_size):
+    """依次检查 BOM、采样的严格 UTF-8 解码，最后才对采样运行 chardet
+
+    不超过三倍采样大小的文件整体检查，更大的文件只读取开头、中间和结尾各
+    sample_size 字节，识别耗时与文件大小无关。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(sample_size)
+        if head.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        if head.startswith((b'\xff\xfe', b'\xfe\xff')):
+            return 'utf-16'
+
+        samples = [head]
+        if size > sample_size * 3:
+            for offset in (size // 2, size - sample_size):
+                f.seek(offset)
+                samples.append(_align_sample(f.read(sample_size)))
+        else:
+            samples.append(f.read())
+
+    if _decodes(samples, 'utf-8'):
+        return 'utf-8'
+
+    import chardet
+    result = chardet.detect(b'\n'.join(samples))
+    encoding = (result.get('encoding') or '').lower()
+    if not encoding or encoding in ('gb2312', 'gbk', 'gb18030', 'ascii'):
+        # GB18030 是 GB2312/GBK 的超集
+        return 'gb18030'
+    if (result.get('confidence') or 0) < ENCODING_CONFIDENCE and _decodes(samples, 'gb18030'):
+        # 中文内容很少时 chardet 容易误判为其他双字节编码
+        return 'gb18030'
+    return encoding
+
+
+def _align_sample(sample):
+    """从文件中间截取的样本从下一行开始，没有换行时跳过开头不完整的 UTF-8 字符"""
+    newline = sample.find(b'\n')
+    if newline >= 0:
+        return sample[newline + 1:]
+    skip = 0
+    while skip < 3 and skip < len(sample) and 0x80 <= sample[skip] <= 0xBF:
+        skip += 1
+    return sample[skip:]
+
+
+def _decodes(samples, encoding):
+    """各采样都能按该编码严格解码（末尾截断的字符不算错误）"""
+    try:
+        for sample in samples:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _decode_fallback(error):
+    """解码错误处理：UTF-8 文件中途出现的非法字节按 FALLBACK_ENCODING 解码，仍失败时替换为 U+FFFD
+
+    采样识别不可能覆盖整个文件，这样遇到个别 GBK 行时不必回头重新读取文件。
+    """
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    if error.encoding.replace('_', '-').lower().startswith('utf-8'):
+        for width in (2, 4):
+            try:
+                return error.object[error.start:error.start + width].decode(FALLBACK_ENCODING), error.start + width
+            except UnicodeDecodeError:
+                continue
+    return '\ufffd', error.end
+
+
+codecs.register_error(DECODE_ERRORS, _decode_fallback)
+
+
+# ---------------------------------------------------------------------------
+# 读取器：每个读取器都是生成器，按块产出 Chunk
+# ---------------------------------------------------------------------------
+
+def normalize_header(values):
+    """规范化表头：空列名补齐，重复列名加后缀"""
+    header = []
+    seen = {}
+    for i, value in enumerate(values):
+        name = str(value).strip() if value is not None else ''
+        if not name:
+            name = f'列{i + 1}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def iter_row_chunks(path, sheet, rows, chunk_rows, strings=None):
+    """把行迭代器（首行为表头）切分为表格数据块"""
+    import pandas as pd
+
+    header = None
+    batch = []
+    for row in rows:
+        if header is None:
+            if _is_blank(row):
+                continue
+            names = list(row)
+            header = normalize_header(names)
+            continue
+        if _is_blank(row):
+            continue
+        if len(row) > len(header):
+            # 比表头宽的行（如首行是只有一个单元格的标题）：表头补齐空列名，数据不截断；
+            # 之前较短的行由 DataFrame.from_records 补空值
+            names += [None] * (len(row) - len(header))
+            header = normalize_header(names)
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            frame = compact_strings(pd.DataFrame.from_records(batch, columns=header), strings)
+            yield Chunk('table', path, frame, sheet)
+            batch = []
+    if batch:
+        yield Chunk('table', path, compact_strings(pd.DataFrame.from_records(batch, columns=header), strings), sheet)
+
+
+def compact_strings(frame, mode):
+    """压缩重复字符串：intern 让相同的字符串共用一个对象，category 把重复多的文本列转为分类类型"""
+    if not mode:
+        return frame
+    for column in frame.columns[[_is_text_dtype(t) for t in frame.dtypes]]:
+        values = frame[column]
+        if mode == 'category':
+            if values.nunique() <= len(values) * CATEGORY_MAX_RATIO:
+                frame[column] = values.astype('category')
+        elif values.dtype == object:
+            intern = sys.intern
+            frame[column] = [intern(v) if type(v) is str else v for v in values.to_numpy()]
+    return frame
+
+
+def read_xlsx(path, settings):
+    """以只读模式逐行读取 xlsx 工作簿
+
+    settings['sheets'] 限定读取的工作表，settings['columns'] 限定读取的列
+    （表头名或列字母）；指定列时未选中列的单元格不做解析。
+    """
+    import openpyxl
+
+    chunk_rows = settings.get('chunk_rows', CHUNK_ROWS)
+    columns = as_list(settings.get('columns'))
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in select_sheets(wb.worksheets, settings, lambda w: w.title):
+            if columns:
+                header = next((row for row in ws.iter_rows(values_only=True)
+                               if not _is_blank(row)), None)
+                wanted = resolve_columns(header or (), columns)
+                if not wanted:
+                    continue
+                rows = _iter_projected_rows(ws, wanted)
+            else:
+                rows = _pad_rows(ws.iter_rows(values_only=True))
+            for chunk in iter_row_chunks(path, ws.title, rows, chunk_rows, settings.get('strings')):
+                yield chunk
+    finally:
+        wb.close()
+
+
+def _iter_projected_rows(ws, wanted):
+    """逐行解析工作表 XML，只转换所选列的单元格
+
+    wanted 为 {列号(1 起始): 输出位置}。依赖 openpyxl 的内部解析器，
+    不可用时退回普通的整行读取再投影。
+    """
+    try:
+        from openpyxl.worksheet._reader import WorkSheetParser, ROW_TAG
+        from openpyxl.xml import LXML
+        from openpyxl.xml.functions import iterparse
+        from openpyxl.utils.cell import get_column_letter
+        source = ws._get_source()
+        wb = ws.parent
+        parser = WorkSheetParser(source, ws._shared_strings, data_only=True, epoch=wb.epoch,
+                                 date_formats=wb._date_formats,
+                                 timedelta_formats=wb._timedelta_formats)
+    except (ImportError, AttributeError, TypeError):
+        yield from _project_rows(ws.iter_rows(values_only=True), wanted)
+        return
+
+    # 大多数工作表的单元格是连续的：先按位置直接取，引用不符时再逐个查找
+    targets = [(get_column_letter(column), column - 1, position)
+               for column, position in wanted.items()]
+    width = len(wanted)
+    with source:
+        if LXML:
+            from lxml.etree import iterparse as lxml_iterparse
+            rows = (element for _, element in lxml_iterparse(source, tag=ROW_TAG))
+        else:
+            rows = (element for _, element in iterparse(source) if element.tag == ROW_TAG)
+        for element in rows:
+            values = [None] * width
+            count = len(element)
+            for letter, index, position in targets:
+                cell = element[index] if index < count else None
+                ref = cell.get('r') if cell is not None else None
+                if cell is None or (ref and ref.rstrip('0123456789') != letter):
+                    cell = _find_cell(element, letter, index)
+                if cell is not None:
+                    values[position] = parser.parse_cell(cell)['value']
+            element.clear()
+            if LXML:
+                # 删除已处理的行，避免文档树随行数增长
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            yield values
+
+
+def _find_cell(row, letter, index):
+    """在稀疏行中按列字母（无引用时按位置）查找单元格"""
+    column = -1
+    for cell in row:
+        ref = cell.get('r')
+        if ref:
+            if ref.rstrip('0123456789') == letter:
+                return cell
+        else:
+            column += 1
+            if column == index:
+                return cell
+    return None
+
+
+def _project_rows(rows, wanted):
+    """从完整的行中取出所选列"""
+    for row in rows:
+        values = [None] * len(wanted)
+        for column, position in wanted.items():
+            if column <= len(row):
+                values[position] = row[column - 1]
+        yield values
+
+
+def _pad_rows(rows):
+    """只读模式下各行长度可能不同（工作表没有 <dimension> 时），短行补齐到目前最宽的行
+
+    更宽的行不截断，由 iter_row_chunks 扩展表头。
+    """
+    width = 0
+    for row in rows:
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        else:
+            width = len(row)
+        yield row
+
+
+def _is_blank(row):
+    return row is None or all(v is None or v == '' for v in row)
+
+
+def as_list(value):
+    """设置项既可以是列表，也可以是逗号分隔的字符串"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [str(v) for v in value]
+
+
+def select_sheets(sheets, settings, name_of):
+    """按 settings['sheets'] 过滤工作表（保持工作簿中的顺序）"""
+    names = as_list(settings.get('sheets'))
+    if not names:
+        return list(sheets)
+    wanted = {n.lower() for n in names}
+    return [s for s in sheets if name_of(s).lower() in wanted]
+
+
+def resolve_columns(header, columns):
+    """把列设置解析为 {列号(1 起始): 输出位置}
+
+    优先按表头名匹配，其次按列字母（A、B、AA ...）匹配；输出顺序与设置一致，
+    找不到的列忽略。
+    """
+    from openpyxl.utils.cell import column_index_from_string
+
+    names = {}
+    for index, value in enumerate(header, 1):
+        if value is not None:
+            names.setdefault(str(value).strip(), index)
+
+    wanted = {}
+    for column in columns:
+        index = names.get(column)
+        if index is None and column.isalpha() and len(column) <= 3:
+            try:
+                index = column_index_from_string(column.upper())
+            except ValueError:
+                index = None
+        if index is not None and index not in wanted:
+            wanted[index] = len(wanted)
+    return wanted
+
+
+def read_xls(path, settings):
+    """按需加载方式读取旧版 xls 工作簿（支持工作表/列筛选）"""
+    import xlrd
+
+    chunk_rows = settings.get('chunk_rows', CHUNK_ROWS)
+    columns = as_list(settings.get('columns'))
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        # 只加载选中的工作表
+        for index, name in select_sheets(enumerate(book.sheet_names()), settings, lambda s: s[1]):
+            sheet = book.sheet_by_index(index)
+            rows = (tuple(cell.value for cell in row) for row in sheet.get_rows())
+            if columns:
+                header = next((row for row in sheet.get_rows()
+                               if not _is_blank([c.value for c in row])), None)
+                wanted = resolve_columns([c.value for c in header or ()], columns)
+                if not wanted:
+                    book.unload_sheet(index)
+                    continue
+                rows = _project_rows(rows, wanted)
+            for chunk in iter_row_chunks(path, name, rows, chunk_rows, settings.get('strings')):
+                yield chunk
+            book.unload_sheet(index)
+    finally:
+        book.release_resources()
+
+
+def read_csv(path, settings):
+    """分块读取 CSV 文件（指定列时只解析所选列）"""
+    import pandas as pd
+
+    encoding = detect_encoding(path)
+    columns = as_list(settings.get('columns'))
+    usecols = order = None
+    if columns:
+        header = pd.read_csv(path, nrows=0, encoding=encoding, encoding_errors=DECODE_ERRORS).columns
+        # 列字母可能超出 CSV 的实际列数，超出的列忽略
+        wanted = {i: position for i, position in resolve_columns(header, columns).items() if i <= len(header)}
+        if not wanted:
+            return
+        usecols = [i - 1 for i in wanted]
+        order = [header[i - 1] for i in sorted(wanted, key=wanted.get)]
+
+    with open(path, 'rb') as f:
+        reader = pd.read_csv(f, chunksize=settings.get('chunk_rows', CHUNK_ROWS), usecols=usecols,
+                             encoding=encoding, encoding_errors=DECODE_ERRORS)
+        with reader:
+            for frame in reader:
+                if order is not None:
+                    frame = frame[order]
+                frame.columns = normalize_header(frame.columns)
+                yield Chunk('table', path, compact_strings(frame, settings.get('strings')), DEFAULT_SHEET,
+                            f.tell())
+
+
+def read_text(path, settings, start=0, encoding=None):
+    """分块读取文本/日志文件，可从指定字节偏移量开始；返回读到的结束偏移量"""
+    encoding = encoding or detect_encoding(path)
+    chunk_lines = settings.get('text_chunk_lines', TEXT_CHUNK_LINES)
+    with open(path, 'rb') as raw:
+        raw.seek(start)
+        f = io.TextIOWrapper(raw, encoding=encoding, errors=DECODE_ERRORS, newline='')
+        batch = []
+        for line in f:
+            batch.append(line.rstrip('\r\n'))
+            if len(batch) >= chunk_lines:
+                yield Chunk('text', path, batch, position=raw.tell())
+                batch = []
+        if batch:
+            yield Chunk('text', path, batch, position=raw.tell())
+        end = raw.tell()
+        f.detach()
+    return end
+
+
+def read_json(path, settings):
+    """读取 JSON 文件：数组按元素增量解析并分块产出，顶层对象整体产出
+
+    不把整个文件读入内存，顶层数组同时只保留一个数据块的元素。
+    """
+    encoding = detect_encoding(path)
+    chunk_rows = settings.get('chunk_rows', CHUNK_ROWS)
+    with open(path, 'r', encoding=encoding, errors=DECODE_ERRORS) as f:
+        stream = JsonStream(f, settings.get('json_read_block', JSON_READ_BLOCK))
+        if stream.peek() == '[':
+            stream.take('[')
+            records = []
+            if stream.peek() == ']':
+                stream.take(']')
+            else:
+                while True:
+                    records.append(stream.value())
+                    if len(records) >= chunk_rows:
+                        yield Chunk('records', path, records, JSON_SHEET, f.buffer.tell())
+                        records = []
+                    if stream.take(',]') == ']':
+                        break
+            stream.end()
+            if records:
+                yield Chunk('records', path, records, JSON_SHEET, f.buffer.tell())
+            return
+        data = stream.value()
+        stream.end()
+
+    if isinstance(data, dict):
+        yield Chunk('object', path, data, JSON_SHEET)
+    else:
+        yield Chunk('records', path, [data], JSON_SHEET)
+
+
+class JsonStream:
+    """文本流上的增量 JSON 解析：按需读取，缓冲区只保留尚未解析的部分
+
+    单个值用 json 模块的 raw_decode 解析；值在缓冲区末尾被截断时读取更多
+    内容后重试。
+    """
+
+    def __init__(self, f, block=JSON_READ_BLOCK):
+        self.f = f
+        self.block = block
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符（已到结尾时为空串）"""
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in ' \t\n\r':
+            return self.buffer[self.pos]
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.block):
+                return ''
+
+    def take(self, expected):
+        """读取一个分隔符，必须是 expected 中的字符之一"""
+        char = self.peek()
+        if not char or char not in expected:
+            raise json.JSONDecodeError(f"Expecting one of {expected!r}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        """解析下一个完整的 JSON 值"""
+        self.peek()
+        size = self.block
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # 出错位置在缓冲区末尾附近（或字符串未结束）说明值被截断，否则是格式错误
+                if self.eof or (e.pos < len(self.buffer) - 6 and not e.msg.startswith('Unterminated')):
+                    raise
+            else:
+                # 值之后到缓冲区末尾只有数字字符时，数字可能被截断（如 "1." 与 "5"），
+                # 需读到下一个字符确认
+                if self.eof or not JSON_NUMBER_TAIL.match(self.buffer, end):
+                    self.pos = end
+                    return value
+            self._fill(size)
+            size *= 2
+
+    def end(self):
+        if self.peek():
+            raise json.JSONDecodeError('Extra data', self.buffer, self.pos)
+
+
+def read_docx(path, settings):
+    """读取 Word 文档段落（保留样式名）"""
+    from docx import Document
+
+    document = Document(path)
+    paragraphs = [(p.text, p.style.name if p.style is not None else None)
+                  for p in document.paragraphs]
+    if paragraphs:
+        yield Chunk('doc', path, paragraphs, WORD_SHEET)
+
+
+def prepare_docx(path):
+    """Word 输出时 .docx 不解析段落，返回由写入器流式合并正文的加载函数"""
+    if os.path.splitext(path)[1].lower() != '.docx':
+        return None
+    return partial(read_docx_body, path)
+
+
+def read_docx_body(path):
+    with zipfile.ZipFile(path) as package:
+        if 'word/document.xml' not in package.namelist():
+            raise ValueError(f'不是有效的 Word 文档: {path}')
+    yield Chunk('docx', path, path, WORD_SHEET)
+
+
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+# 逐条输出 JSON 时复用的编码器（json.dumps 带参数时每次都会新建编码器）
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+
+
+READERS = {
+    '.xlsx': read_xlsx,
+    '.xlsm': read_xlsx,
+    '.xls': read_xls,
+    '.csv': read_csv,
+    '.txt': read_text,
+    '.log': read_text,
+    '.json': read_json,
+    '.docx': read_docx,
+}
+
+
+def iter_file_chunks(path, settings):
+    """按扩展名选择读取器，逐块产出文件内容"""
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise ValueError(f'不支持的文件类型: {path}')
+    return reader(path, settings)
+
+
+def parse_file(path, settings, spill_dir=None):
+    """工作进程入口：完整解析单个文件，返回数据块列表
+
+    指定 spill_dir 时数据块写入该目录下的列式文件，只返回 (文件路径, 字节数)。
+    """
+    chunks = iter_file_chunks(path, settings)
+    if spill_dir is None:
+        return list(chunks)
+    fd, spill_path = tempfile.mkstemp(suffix='.fmac', dir=spill_dir)
+    size = 0
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in chunks:
+            size += write_columnar(f, chunk)
+    return spill_path, size
+
+
+# ---------------------------------------------------------------------------
+# 文本输出快速路径：UTF-8 输入按原始字节拼接，不逐行解码再编码
+# ---------------------------------------------------------------------------
+
+def prepare_raw(path, settings):
+    """可按原始字节拼接的文件返回加载函数，否则返回 None（走正常读取）"""
+    span = raw_span(path, settings)
+    if span is None:
+        return None
+    return partial(read_raw, path, *span)
+
+
+def raw_span(path, settings):
+    """判断文件能否直接拼接，能则返回 (数据起始偏移, CSV 表头, 表头行)，文本文件的表头为 None
+
+    输出为 UTF-8，因此只有识别为 UTF-8 的文件才能直接拼接（BOM 跳过）。编码
+    识别只看采样，采样之外的内容由 append_bytes 在拷贝时逐块校验，不合法时
+    写入器改走逐行解码（可按行回退到 GB18030）的正常读取。CSV 在不添加
+    来源列、不选择列、且表头无需规范化时可以直接拼接，表头行单独交给
+    写入器，相同的表头只写一次。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    is_csv = ext in RAW_CSV_EXTENSIONS
+    if is_csv:
+        if settings.get('add_source') or as_list(settings.get('columns')):
+            return None
+    elif ext not in RAW_TEXT_EXTENSIONS:
+        return None
+
+    encoding = detect_encoding(path)
+    if encoding not in ('utf-8', 'utf-8-sig'):
+        return None
+    start = 3 if encoding == 'utf-8-sig' else 0
+    if not is_csv:
+        return start, None, None
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        line = f.readline(RAW_HEADER_MAX)
+    if not line.endswith(b'\n'):
+        return None
+    try:
+        names = next(csv.reader([line.decode('utf-8').rstrip('\r\n')]), [])
+    except (UnicodeDecodeError, csv.Error):
+        return None
+    if not names or normalize_header(names) != names:
+        return None
+    return start + len(line), names, line.decode('utf-8')
+
+
+def read_raw(path, start, header, header_line):
+    """产出覆盖 [start, 文件末尾) 的原始字节数据块；没有内容时不产出"""
+    end = os.path.getsize(path)
+    if start < end:
+        yield Chunk('raw', path, (start, end, header, header_line),
+                    DEFAULT_SHEET if header is not None else None, end)
+
+
+def append_bytes(path, start, end, out_fd):
+    """把文件 [start, end) 的字节追加写入 out_fd，返回 (换行数, 最后一个字节)
+
+    优先使用 copy_file_range / sendfile 在内核中拷贝；不支持的平台（如 Windows）
+    按块写出内存映射的内容。每块拷贝前在内存映射上增量解码校验 UTF-8 并统计
+    行数，页面随后仍在缓存中供拷贝使用，文件只读一遍。内容不是合法的 UTF-8
+    时抛出 UnicodeDecodeError，此前已拷贝的部分由调用方截断。
+    """
+    lines = 0
+    last = None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = min(end, len(mm))
+        offset = start
+        while offset < end:
+            count = min(RAW_COPY_BLOCK, end - offset)
+            for block in range(offset, offset + count, RAW_VALIDATE_BLOCK):
+                decoder.decode(mm[block:min(block + RAW_VALIDATE_BLOCK, offset + count)])
+            if offset + count == end:
+                decoder.decode(b'', final=True)
+            lines += mm[offset:offset + count].count(b'\n')
+            _copy_range(f.fileno(), out_fd, offset, count, mm)
+            offset += count
+        if end > start:
+            last = mm[end - 1:end]
+    return lines, last
+
+
+def _copy_range(in_fd, out_fd, offset, count, mm):
+    """拷贝 count 个字节，内核拷贝失败时回退为普通写入"""
+    while count > 0:
+        copied = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                copied = os.copy_file_range(in_fd, out_fd, count, offset)
+            elif hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+                copied = os.sendfile(out_fd, in_fd, offset, count)
+        except OSError:
+            copied = 0
+        if copied <= 0:
+            copied = os.write(out_fd, mm[offset:offset + count])
+        offset += copied
+        count -= copied
+
+
+# ---------------------------------------------------------------------------
+# 并行解析：进程池解析，按文件顺序交给写入器
+# ---------------------------------------------------------------------------
+
+def iter_sources(files, settings, log, prepare=None, spill=None):
+    """按文件顺序产出 (路径, 加载函数)
+
+    workers > 1 时由进程池提前解析后续文件，主进程按原顺序取回结果，
+    输出顺序与文件枚举顺序一致。超过 PARALLEL_MAX_BYTES 的大文件仍在
+    主进程中流式读取，避免整文件结果在进程间传递。prepare(path) 可以为
+    文件提供现成的加载函数（如增量缓存），这些文件不再提交给进程池。
+    主进程超过内存预算时，工作进程把解析结果写入 spill 的临时目录，主进程
+    按内存映射读回，等待写入的结果不再占用内存。
+    """
+    prepare = prepare or (lambda path: None)
+    workers = max(1, int(settings.get('workers', 1) or 1))
+    if workers > 1:
+        try:
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        except (OSError, ImportError, NotImplementedError, ValueError) as e:
+            log(f"无法启动进程池，改用串行模式: {e}")
+        else:
+            log(f"并行解析: {workers} 个进程")
+            yield from _iter_pool_sources(pool, files, settings, workers, prepare, spill)
+            return
+
+    for path in files:
+        yield path, prepare(path) or partial(iter_file_chunks, path, settings)
+
+
+def _iter_pool_sources(pool, files, settings, workers, prepare, spill):
+    """滑动窗口提交解析任务，按提交顺序取回结果"""
+    pending = deque()
+    remaining = iter(files)
+    max_bytes = settings.get('parallel_max_bytes', PARALLEL_MAX_BYTES)
+
+    def submit_next():
+        path = next(remaining, None)
+        if path is None:
+            return
+        load = prepare(path)
+        if load is None and os.path.getsize(path) <= max_bytes:
+            spill_dir = spill.path() if spill and spill.budget.exceeded() else None
+            try:
+                future = pool.submit(parse_file, path, settings, spill_dir)
+                load = partial(_pool_result, future, path, settings, spill)
+            except BrokenProcessPool:
+                pass
+        pending.append((path, load or partial(iter_file_chunks, path, settings)))
+
+    try:
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            item = pending.popleft()
+            submit_next()
+            yield item
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _pool_result(future, path, settings, spill=None):
+    """取回解析结果；进程池异常退出时回退为主进程读取"""
+    try:
+        result = future.result()
+    except BrokenProcessPool:
+        return iter_file_chunks(path, settings)
+    if isinstance(result, tuple):
+        spill_path, size = result
+        spill.bytes += size
+        return _iter_spilled(spill_path)
+    return result
+
+
+def _iter_spilled(path):
+    """内存映射读回工作进程写出的列式文件，读完后删除"""
+    yield from iter_columnar(path)
+    _remove_quietly(path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Windows 下仍被映射的文件无法删除，由 SpillDir.cleanup 统一清理
+        pass
+
+
+# ---------------------------------------------------------------------------
+# 内存预算与溢写
+# ---------------------------------------------------------------------------
+
+class MemoryBudget:
+    """内存预算：用 psutil 测量当前进程的常驻内存，判断是否需要把数据写入磁盘
+
+    settings['memory_budget'] 为预算字节数，默认 MEMORY_BUDGET。无法测量
+    （未安装 psutil）时总是视为超出预算。
+    """
+
+    def __init__(self, settings):
+        self.limit = settings.get('memory_budget') or MEMORY_BUDGET
+        try:
+            import psutil
+            self.process = psutil.Process()
+        except (ImportError, OSError):
+            self.process = None
+
+    def exceeded(self):
+        if self.process is None:
+            return True
+        return self.process.memory_info().rss > self.limit
+
+
+class SpillDir:
+    """溢写临时目录：首次使用时在输出文件旁创建，cleanup() 时删除；bytes 为溢写字节数"""
+
+    def __init__(self, output_file, settings, suffix=SPILL_SUFFIX):
+        self.budget = MemoryBudget(settings)
+        self.output_file = output_file
+        self.suffix = suffix
+        self.dir = None
+        self.bytes = 0
+
+    def path(self):
+        if self.dir is None:
+            self.dir = tempfile.mkdtemp(prefix=os.path.basename(self.output_file) + self.suffix,
+                                        dir=os.path.dirname(os.path.abspath(self.output_file)))
+        return self.dir
+
+    def cleanup(self):
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+
+# ---------------------------------------------------------------------------
+# 运行指标
+# ---------------------------------------------------------------------------
+
+class Telemetry:
+    """合并过程的运行指标：内存、吞吐量、当前阶段与预计剩余时间
+
+    read_seconds 为等待读取/解析的时间，write_seconds 为写入输出的时间，两者
+    对比可以看出瓶颈在读取还是写入；stage_seconds 为各阶段（如最后生成 Excel
+    的"生成输出"）的耗时；rss 接近内存预算时说明在换出到磁盘。
+
+    progress 按字节计算：已处理（含续传跳过）的输入字节数 / 输入总字节数，
+    读取器给出数据块的字节偏移时在文件内按数据块推进。写入器在关闭时才
+    生成输出（有 close_work 属性，如 Excel）时，生成阶段按行数计入进度：
+    读取与生成两部分按各自的速度折算为时间加权，生成阶段开始前按
+    OUTPUT_ROWS_PER_S 估计。输入总量由 scan() 在后台线程走完扫描时得到（与
+    处理共用同一遍扫描），通常在处理前几个文件时即可得到；统计完成前
+    progress 与 eta 为 None。回调 callback(metrics) 最多每 METRICS_INTERVAL
+    秒调用一次，调用方（如界面）无需再自行节流。
+    """
+
+    def __init__(self, callback=None, settings=None):
+        self.callback = callback
+        self.interval = (settings or {}).get('metrics_interval', METRICS_INTERVAL)
+        self.start = time.perf_counter()
+        self.last = 0.0
+        self.stage = '扫描'
+        self.stage_start = self.start
+        self.stage_seconds = {}
+        self.files = 0
+        self.bytes = 0
+        self.file_bytes = 0
+        self.rows = 0
+        self.found_files = 0
+        self.found_bytes = 0
+        self.skipped_bytes = 0
+        self.total_files = None
+        self.total_bytes = None
+        self.current = None
+        self.writer = None
+        self.generated_rows = 0
+        self.reported = 0.0
+        self.stopped = False
+        self.read_seconds = 0.0
+        self.write_seconds = 0.0
+        self.peak_rss = 0
+        try:
+            import psutil
+            self.process = psutil.Process()
+        except (ImportError, OSError):
+            self.process = None
+
+    def scan(self, files):
+        """在后台线程中走完扫描并统计文件数与总字节数，按原顺序产出扫描到的文件
+
+        处理不必等待扫描结束；扫描先于处理走完时即可得到进度所需的总量。
+        """
+        found = queue.Queue()
+        thread = threading.Thread(target=self._scan, args=(files, found), daemon=True)
+        thread.start()
+        while True:
+            path = found.get()
+            if path is None:
+                return
+            if isinstance(path, BaseException):
+                raise path
+            yield path
+
+    def _scan(self, files, found):
+        try:
+            for path in files:
+                if self.stopped:
+                    return
+                self.found_files += 1
+                self.found_bytes += _file_size(path)
+                found.put(path)
+            self.total_files, self.total_bytes = self.found_files, self.found_bytes
+        except Exception as e:
+            found.put(e)
+        finally:
+            found.put(None)
+
+    def skip(self, paths):
+        """续传跳过的文件计入进度，但不计入吞吐量"""
+        for path in paths:
+            self.skipped_bytes += _file_size(path)
+
+    def stop(self):
+        self.stopped = True
+
+    def set_stage(self, stage):
+        now = time.perf_counter()
+        self.stage_seconds[self.stage] = self.stage_seconds.get(self.stage, 0.0) + now - self.stage_start
+        self.stage = stage
+        self.stage_start = now
+        self.tick(force=True)
+
+    def chunk_done(self, chunk):
+        """记录写入的数据块：带字节偏移的数据块在文件内推进进度"""
+        if chunk.position is not None:
+            self.file_bytes = chunk.position
+        self.tick()
+
+    def generated(self, rows):
+        """记录生成阶段写出的行数"""
+        self.generated_rows += rows
+        self.tick()
+
+    def file_done(self, path, rows, seconds, write_seconds):
+        """记录处理完的文件"""
+        self.files += 1
+        self.rows += rows
+        self.bytes += _file_size(path)
+        self.file_bytes = 0
+        self.current = os.path.basename(path)
+        self.write_seconds += write_seconds
+        self.read_seconds += max(seconds - write_seconds, 0.0)
+        self.tick()
+
+    def tick(self, force=False):
+        """到达回调间隔时发送一次指标"""
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            self.callback(self.snapshot())
+
+    def seconds(self, stage):
+        """某阶段的累计时间（含正在进行的部分）"""
+        seconds = self.stage_seconds.get(stage, 0.0)
+        if self.stage == stage:
+            seconds += time.perf_counter() - self.stage_start
+        return seconds
+
+    def paused_seconds(self):
+        """累计暂停时间（含正在进行的暂停）"""
+        return self.seconds(PAUSED_STAGE)
+
+    def estimate(self, active):
+        """返回 (进度, 预计剩余秒数)；输入总量未知时为 (None, None)"""
+        if self.total_bytes is None:
+            return None, None
+        read = self.bytes + self.file_bytes
+        done = min(self.skipped_bytes + read, self.total_bytes)
+        if not self.total_bytes:
+            return 1.0, 0.0
+        work = getattr(self.writer, 'close_work', None)
+        if work is None or not read:
+            # 没有生成阶段（或读取速度未知）：只按字节计算
+            progress = done / self.total_bytes
+            eta = (self.total_bytes - done) / (read / active) if read else None
+            return progress, eta
+        generating = self.seconds(OUTPUT_STAGE)
+        read_rate = read / max(active - generating, 1e-9)
+        output_rate = self.generated_rows / generating if self.generated_rows else OUTPUT_ROWS_PER_S
+        if self.stage != OUTPUT_STAGE and not self.generated_rows and done < self.total_bytes:
+            # 仍在读取：按已读比例外推最终需要生成的行数
+            work = work * self.total_bytes / max(done, 1)
+        total = self.total_bytes / read_rate + work / output_rate
+        remaining = (self.total_bytes - done) / read_rate + max(work - self.generated_rows, 0) / output_rate
+        return max(1.0 - remaining / total, 0.0), remaining
+
+    def snapshot(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        # 吞吐量与剩余时间按实际运行时间计算，不含暂停
+        active = max(elapsed - self.paused_seconds(), 1e-9)
+        rss = None
+        if self.process is not None:
+            try:
+                rss = self.process.memory_info().rss
+                self.peak_rss = max(self.peak_rss, rss)
+            except OSError:
+                pass
+        progress, eta = self.estimate(active)
+        if self.stage == '完成':
+            progress, eta = 1.0, 0.0
+        if progress is not None:
+            # 速度估计修正时进度条不后退
+            progress = self.reported = max(progress, self.reported)
+        return {
+            'stage': self.stage,
+            'elapsed': elapsed,
+            'rss': rss,
+            'peak_rss': self.peak_rss or None,
+            'files': self.files,
+            'bytes': self.bytes,
+            'rows': self.rows,
+            'total_files': self.total_files,
+            'total_bytes': self.total_bytes,
+            'current': self.current,
+            'progress': progress,
+            'files_per_s': self.files / active,
+            'mb_per_s': self.bytes / active / 1024 / 1024,
+            'rows_per_s': self.rows / active,
+            'read_seconds': self.read_seconds,
+            'write_seconds': self.write_seconds,
+            'stage_seconds': dict(self.stage_seconds),
+            'eta': eta,
+        }
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# ---------------------------------------------------------------------------
+# 取消与暂停
+# ---------------------------------------------------------------------------
+
+class MergeCancelled(Exception):
+    """合并被用户取消"""
+
+
+class MergeControl:
+    """合并的取消与暂停控制，可从其他线程调用
+
+    引擎在文件与数据块边界调用 check()：暂停时阻塞到继续为止（进程池中
+    已提交的文件解析完后也不再提交新任务），取消时抛出 MergeCancelled。
+    """
+
+    def __init__(self):
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = False
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.running.set()
+
+    def check(self, telemetry=None):
+        if self.paused:
+            stage = telemetry.stage if telemetry else None
+            if telemetry:
+                telemetry.set_stage(PAUSED_STAGE)
+            self.running.wait()
+            if telemetry:
+                telemetry.set_stage(stage)
+        if self.cancelled:
+            raise MergeCancelled()
+
+
+# ---------------------------------------------------------------------------
+# 数据块转换
+# ---------------------------------------------------------------------------
+
+def chunk_to_frame(chunk):
+    """把任意数据块转换为 (工作表名, DataFrame)"""
+    import pandas as pd
+
+    if chunk.kind == 'table':
+        return chunk.sheet, chunk.data
+    if chunk.kind == 'text':
+        return TEXT_SHEET, pd.DataFrame({'内容': chunk.data})
+    if chunk.kind == 'doc':
+        return WORD_SHEET, pd.DataFrame(chunk.data, columns=['段落', '样式'])
+    if chunk.kind == 'object':
+        return JSON_SHEET, _flatten_nested(pd.json_normalize(chunk.data))
+    # records
+    if all(isinstance(r, dict) for r in chunk.data):
+        return JSON_SHEET, _flatten_nested(pd.json_normalize(chunk.data))
+    return JSON_SHEET, pd.DataFrame({'值': [json.dumps(r, ensure_ascii=False, default=str)
+                                           if isinstance(r, (dict, list)) else r
+                                           for r in chunk.data]})
+
+
+def json_items(chunk):
+    """JSON 数据块中的元素列表（顶层对象视为单个元素）"""
+    return [chunk.data] if chunk.kind == 'object' else chunk.data
+
+
+def _flatten_nested(frame):
+    """json_normalize 之后仍为数组的单元格转为 JSON 字符串"""
+    for column in frame.columns[frame.dtypes == object]:
+        frame[column] = frame[column].map(
+            lambda v: json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, (list, dict)) else v)
+    return frame
+
+
+def frame_rows(frame):
+    """把 DataFrame 转为 Python 原生值的行（缺失值为 None）"""
+    values = frame.astype(object).where(frame.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+class SourceTagger:
+    """为数据块添加来源信息（来源文件、来源路径、工作表、时间戳）
+
+    表格数据块添加来源列。输出为 Excel 时其他数据块先按 chunk_to_frame 转为
+    表格再添加；输出为 JSON / JSON Lines 时 JSON 元素（非对象的元素包装为
+    {"值": ...}）直接加入来源字段以保留嵌套结构，文本行与段落转为表格后添加。
+    JSON 输出深度合并的顶层对象，以及文本、Word 输出（按来源写分隔行）的
+    非表格数据块不添加。
+
+    来源信息按 (路径, 工作表) 保存在字典中，每个来源只读取一次修改时间并
+    构造一次字符串：各列为只含一个类别的分类类型，数据块按行数生成 int8
+    编码后一次性添加，行中不保存字符串。文件按顺序处理，字典超过
+    SOURCE_TAG_CACHE 项时清空。
+    """
+
+    def __init__(self, output_format='excel'):
+        self.output_format = output_format
+        self.tags = {}
+
+    def tag(self, chunk):
+        if chunk.kind == 'table':
+            return self._tag_frame(chunk, chunk.data, chunk.sheet)
+        if self.output_format == 'excel' or (self.output_format in ('json', 'jsonl')
+                                             and chunk.kind in ('text', 'doc')):
+            sheet, frame = chunk_to_frame(chunk)
+            return self._tag_frame(chunk, frame, sheet)
+        if chunk.kind == 'records' and self.output_format in ('json', 'jsonl'):
+            return Chunk('records', chunk.source, self._tag_items(chunk, chunk.data), chunk.sheet)
+        if chunk.kind == 'object' and self.output_format == 'jsonl':
+            return Chunk('object', chunk.source, self._tag_items(chunk, [chunk.data])[0], chunk.sheet)
+        return chunk
+
+    def _tag_frame(self, chunk, frame, sheet):
+        import numpy as np
+        import pandas as pd
+
+        _, dtypes = self._source(chunk)
+        rows = len(frame)
+        columns = {name: pd.Categorical.from_codes(np.zeros(rows, dtype=np.int8), dtype=dtype)
+                   for name, dtype in dtypes}
+        return Chunk('table', chunk.source, frame.assign(**columns), sheet)
+
+    def _tag_items(self, chunk, items):
+        fields, _ = self._source(chunk)
+        return [dict(item, **fields) if isinstance(item, dict) else dict({'值': item}, **fields)
+                for item in items]
+
+    def _source(self, chunk):
+        """返回来源的 (字段字典, 列类型列表)"""
+        key = (chunk.source, chunk.sheet)
+        source = self.tags.get(key)
+        if source is None:
+            if len(self.tags) >= SOURCE_TAG_CACHE:
+                self.tags.clear()
+            source = self.tags[key] = self._build(chunk)
+        return source
+
+    @staticmethod
+    def _build(chunk):
+        import pandas as pd
+
+        mtime = datetime.fromtimestamp(os.path.getmtime(chunk.source)).strftime('%Y-%m-%d %H:%M:%S')
+        sheet = '' if chunk.sheet is None else str(chunk.sheet)
+        fields = dict(zip(SOURCE_COLUMNS, (os.path.basename(chunk.source), chunk.source, sheet, mtime)))
+        return fields, [(name, pd.CategoricalDtype([value])) for name, value in fields.items()]
+
+
+def sheet_title(name, used):
+    """生成合法且不重复的 Excel 工作表名"""
+    title = ''.join('_' if c in INVALID_SHEET_CHARS else c for c in str(name)).strip("'")
+    title = title[:MAX_SHEET_NAME] or DEFAULT_SHEET
+    base, n = title, 1
+    while title.lower() in used:
+        suffix = f'_{n}'
+        title = base[:MAX_SHEET_NAME - len(suffix)] + suffix
+        n += 1
+    used.add(title.lower())
+    return title
+
+
+# ---------------------------------------------------------------------------
+# 处理阶段：数据块写入前依次经过各阶段，process(chunk) 返回处理后的数据块
+# （返回 None 表示丢弃），finish() 在全部输入处理完后产出汇总数据块
+# ---------------------------------------------------------------------------
+
+class LineFilter:
+    """按日志级别与正则表达式筛选文本行，只保留匹配的行
+
+    settings 中的相关设置：
+        levels        - 保留的日志级别（如 ERROR,FATAL），按整词匹配
+        line_pattern  - 行需匹配的正则表达式
+    两者都设置时需同时满足。
+    """
+    resumable = True
+
+    def __init__(self, settings):
+        levels = as_list(settings.get('levels'))
+        self.level = re.compile(r'\b(?:%s)\b' % '|'.join(map(re.escape, levels))) if levels else None
+        pattern = settings.get('line_pattern')
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def process(self, chunk):
+        if chunk.kind != 'text':
+            return chunk
+        lines = chunk.data
+        if self.level is not None:
+            search = self.level.search
+            lines = [line for line in lines if search(line)]
+        if self.pattern is not None:
+            search = self.pattern.search
+            lines = [line for line in lines if search(line)]
+        if not lines:
+            return None
+        return Chunk('text', chunk.source, lines, chunk.sheet)
+
+    def finish(self):
+        return ()
+
+
+class IpCounter:
+    """统计文本行中出现的 IPv4 地址，结束时产出按次数排序的统计表
+
+    地址按 32 位整数作为键计数，同一行中重复出现的地址只计一次。计数只保存
+    在内存中，因此启用时不支持断点续传。
+    """
+    resumable = False
+
+    def __init__(self, settings):
+        self.pattern = re.compile(settings.get('ip_pattern') or IP_PATTERN)
+        self.counts = {}
+
+    def process(self, chunk):
+        if chunk.kind != 'text':
+            return chunk
+        counts = self.counts
+        findall = self.pattern.findall
+        for line in chunk.data:
+            seen = None
+            for octets in findall(line):
+                a, b, c, d = map(int, octets)
+                if a > 255 or b > 255 or c > 255 or d > 255:
+                    continue
+                key = (a << 24) | (b << 16) | (c << 8) | d
+                if seen is None:
+                    seen = {key}
+                elif key in seen:
+                    continue
+                else:
+                    seen.add(key)
+                counts[key] = counts.get(key, 0) + 1
+        return chunk
+
+    def finish(self):
+        if not self.counts:
+            return
+        import pandas as pd
+
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        rows = [(f'{k >> 24}.{(k >> 16) & 255}.{(k >> 8) & 255}.{k & 255}', n) for k, n in items]
+        yield Chunk('table', None, pd.DataFrame(rows, columns=list(IP_COLUMNS)), IP_SHEET)
+
+
+class HashIndex:
+    """64 位指纹的集合，以有序 uint64 数组保存，不使用 Python 集合
+
+    新加入的指纹作为一个有序段，相邻段大小接近时合并，段数保持为对数级；
+    查询时在各段上二分查找。内存中的段超过 memory 字节后合并写成磁盘上的
+    有序段，之后按内存映射查询，只读入二分查找经过的页；磁盘上的段同样在
+    大小接近时分块归并，归并时内存占用不超过两个分块。
+    """
+
+    def __init__(self, spill, memory):
+        self.spill = spill
+        self.memory = memory
+        self.runs = []
+        self.disk = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count + sum(len(run) for run in self.disk)
+
+    def contains(self, keys):
+        """keys 为有序数组，返回各指纹是否已在集合中"""
+        import numpy as np
+
+        found = np.zeros(len(keys), dtype=bool)
+        for run in itertools.chain(self.runs, self.disk):
+            positions = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[positions] == keys
+        return found
+
+    def add(self, keys):
+        """加入集合中还没有的有序指纹"""
+        import numpy as np
+
+        if not len(keys):
+            return
+        self.runs.append(keys)
+        self.count += len(keys)
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            last = self.runs.pop()
+            merged = np.concatenate((self.runs.pop(), last))
+            merged.sort(kind='stable')  # 两个有序段拼接，归并排序为线性
+            self.runs.append(merged)
+        if self.count * 8 > self.memory:
+            self._spill()
+
+    def _spill(self):
+        import numpy as np
+
+        merged = np.concatenate(self.runs)
+        merged.sort(kind='stable')
+        self.disk.append(self._write_run([merged]))
+        self.runs = []
+        self.count = 0
+        while len(self.disk) > 1 and len(self.disk[-2]) <= 2 * len(self.disk[-1]):
+            last = self.disk.pop()
+            first = self.disk.pop()
+            self.disk.append(self._write_run(_merge_sorted(first, last, DEDUP_MERGE_BLOCK)))
+            paths = (first.filename, last.filename)
+            del first, last
+            for path in paths:
+                _remove_quietly(path)
+
+    def _write_run(self, parts):
+        """把有序的数组分块写入临时文件，返回其内存映射"""
+        import numpy as np
+
+        fd, path = tempfile.mkstemp(suffix='.fmah', dir=self.spill.path())
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                part.tofile(f)
+                self.spill.bytes += part.nbytes
+        return np.memmap(path, dtype=np.uint64, mode='r')
+
+    def cleanup(self):
+        # 先释放内存映射，Windows 下映射中的文件无法删除
+        self.runs = []
+        self.disk = []
+        self.count = 0
+        self.spill.cleanup()
+
+
+def _merge_sorted(a, b, block):
+    """分块归并两个有序且互不相交的数组，每次产出不超过 2 * block 个元素"""
+    import numpy as np
+
+    i = j = 0
+    while i < len(a) or j < len(b):
+        # 取两边当前分块末尾的较小值为界，界以内的部分可以直接归并输出
+        pivots = [run[min(k + block, len(run)) - 1] for run, k in ((a, i), (b, j)) if k < len(run)]
+        pivot = min(pivots)
+        end_a = np.searchsorted(a, pivot, 'right')
+        end_b = np.searchsorted(b, pivot, 'right')
+        part = np.concatenate((a[i:end_a], b[j:end_b]))
+        part.sort(kind='stable')
+        yield part
+        i, j = end_a, end_b
+
+
+class Deduplicator:
+    """跨文件去除重复行：表格行、文本行与 JSON 元素按键的 64 位指纹判断
+
+    settings 中的相关设置：
+        dedup_columns - 作为键的列（逗号分隔）；不设置时按整行比较
+        dedup_memory  - 指纹索引在内存中的上限（字节），超出后写入磁盘
+    表格按列名比较，与列的顺序无关，缺少的列与空值相同；数值 1 与 1.0 视为
+    相同。键全部为空的行与空行不去重。指纹按列向量化计算（pandas 的
+    hash_array），保存在 HashIndex 中，每行只占 8 字节。64 位指纹在数亿行
+    时误判为重复的概率仍远小于 1%。索引只保存在内存与临时文件中，因此启用
+    时不支持断点续传。
+    """
+    resumable = False
+
+    def __init__(self, settings, output_file):
+        self.columns = as_list(settings.get('dedup_columns'))
+        memory = settings.get('dedup_memory') or DEDUP_MEMORY
+        self.index = HashIndex(SpillDir(output_file, settings, DEDUP_SUFFIX), memory)
+        self.duplicates = 0
+
+    def process(self, chunk):
+        if chunk.kind == 'table':
+            hashes, present = self._frame_hashes(chunk.data)
+        elif chunk.kind == 'text':
+            hashes, present = self._text_hashes(chunk.data)
+        elif chunk.kind == 'records':
+            hashes, present = self._text_hashes([self._record_key(r) for r in chunk.data])
+        else:
+            return chunk
+        keep = self._first_seen(hashes, present)
+        if keep is None:
+            return chunk
+        if not keep.any():
+            return None
+        if chunk.kind == 'table':
+            return Chunk('table', chunk.source, chunk.data[keep].reset_index(drop=True), chunk.sheet)
+        data = [item for item, kept in zip(chunk.data, keep) if kept]
+        return Chunk(chunk.kind, chunk.source, data, chunk.sheet)
+
+    def _first_seen(self, hashes, present):
+        """每个指纹只保留第一次出现的行，返回保留行的掩码（全部保留时为 None）"""
+        import numpy as np
+
+        rows = np.flatnonzero(present)
+        keys, first = np.unique(hashes[rows], return_index=True)
+        seen = self.index.contains(keys)
+        self.index.add(keys[~seen])
+        kept = rows[first[~seen]]
+        dropped = len(rows) - len(kept)
+        if not dropped:
+            return None
+        self.duplicates += dropped
+        keep = ~present
+        keep[kept] = True
+        return keep
+
+    def _frame_hashes(self, frame):
+        """各行的指纹：每列的值哈希与列名混合后求和，与列的顺序无关"""
+        import numpy as np
+        from pandas.util import hash_array
+
+        names = {str(column): column for column in frame.columns}
+        total = np.zeros(len(frame), dtype=np.uint64)
+        present = np.zeros(len(frame), dtype=bool)
+        for name in self.columns or names:
+            if name not in names:
+                continue
+            values = frame[names[name]]
+            mask = values.notna().to_numpy()
+            if not mask.any():
+                continue
+            hashes = hash_array(_hash_values(values) ^ _name_hash(name))
+            total += np.where(mask, hashes, np.uint64(0))
+            present |= mask
+        return total, present
+
+    def _text_hashes(self, lines):
+        import numpy as np
+        from pandas.util import hash_array
+
+        values = np.array(lines, dtype=object)
+        present = np.fromiter(map(bool, lines), dtype=bool, count=len(lines))
+        return hash_array(values), present
+
+    def _record_key(self, record):
+        """JSON 元素的键文本：对象按排序后的键序列化，指定了列时只取这些键"""
+        if isinstance(record, dict) and self.columns:
+            record = {key: record[key] for key in self.columns if record.get(key) is not None}
+            if not record:
+                return ''
+        return json.dumps(record, ensure_ascii=False, sort_keys=True, default=str)
+
+    def finish(self):
+        return ()
+
+    def cleanup(self):
+        self.index.cleanup()
+
+
+def _hash_values(values):
+    """一列值转为 uint64 数组用于哈希：整数值的浮点数按整数，文本按字符串哈希"""
+    import numpy as np
+    from pandas.util import hash_array
+
+    kind = values.dtype.kind
+    if kind in 'iub':
+        return values.to_numpy(dtype=np.int64, na_value=0).view(np.uint64)
+    if kind == 'f':
+        array = values.to_numpy(dtype=np.float64, na_value=0.0)
+        whole = np.isfinite(array) & (array == np.round(array)) & (np.abs(array) < 2.0 ** 63)
+        return np.where(whole, np.where(whole, array, 0).astype(np.int64).view(np.uint64), array.view(np.uint64))
+    if kind in 'mM':
+        unit = 'datetime64[ns]' if kind == 'M' else 'timedelta64[ns]'
+        return values.to_numpy(dtype=unit).view(np.uint64)
+    return hash_array(values.astype(str).to_numpy(dtype=object))
+
+
+def _name_hash(name):
+    import numpy as np
+
+    digest = hashlib.blake2b(name.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return np.uint64(int.from_bytes(digest, 'little'))
+
+
+def build_stages(settings, output_file=None):
+    """根据设置创建处理阶段（output_file 用于确定临时文件的位置）"""
+    stages = []
+    if as_list(settings.get('levels')) or settings.get('line_pattern'):
+        stages.append(LineFilter(settings))
+    if settings.get('dedup') or as_list(settings.get('dedup_columns')):
+        stages.append(Deduplicator(settings, output_file or os.path.join(tempfile.gettempdir(), 'fma')))
+    if settings.get('ip_stats'):
+        stages.append(IpCounter(settings))
+    return stages
+
+
+def write_chunk(writer, chunk, stages=(), tagger=None):
+    """数据块依次经过处理阶段，添加来源列（tagger 为 SourceTagger）后交给写入器"""
+    for stage in stages:
+        chunk = stage.process(chunk)
+        if chunk is None:
+            return
+    if tagger is not None:
+        chunk = tagger.tag(chunk)
+    writer.write(chunk)
+
+
+def finish_stages(writer, stages):
+    """产出各阶段的汇总结果，汇总数据块只经过之后的阶段"""
+    for i, stage in enumerate(stages):
+        for chunk in stage.finish():
+            write_chunk(writer, chunk, stages[i + 1:])
+
+
+# ---------------------------------------------------------------------------
+# 写入器：所有写入器都支持 write(chunk) 与 close(check=None)；check(rows) 在
+# 耗时的收尾过程中定期调用，用于暂停与取消，rows 为接下来要生成的行数（用于
+# 进度）。关闭时才生成输出的写入器以 close_work 给出生成阶段的总行数
+# ---------------------------------------------------------------------------
+
+class ExcelWriter:
+    """Excel 输出：只写模式流式写入，内存占用与输出行数无关
+
+    同名工作表的表头可能不同（如各供应商报表的列有增减、顺序不同），因此各
+    数据块先暂存，同时逐块累积统一表头（按首次出现的顺序）与各列出现过的
+    类型。暂存的数据块先保存在内存中，超过 spool_memory（默认 SPOOL_MEMORY）
+    或进程超过内存预算时写入输出文件旁的临时目录（列式帧），关闭时按内存
+    映射读回，写入器的内存占用不随输出行数增长。关闭时每个工作表只确定一次表头与
+    列类型，暂存的数据块按列名整体重排（reindex）后写入。达到 Excel 行数
+    上限后自动续写到 "<工作表名>_2"、"<工作表名>_3" ...，并重复写入表头。
+    """
+
+    def __init__(self, output_file, settings):
+        import openpyxl
+
+        self.output_file = output_file
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.max_rows = settings.get('excel_max_rows', EXCEL_MAX_ROWS)
+        self.spill = SpillDir(output_file, settings, SPOOL_SUFFIX)
+        self.spool_memory = settings.get('spool_memory', SPOOL_MEMORY)
+        self.staged = 0
+        self.sheets = {}
+        self.titles = set()
+        self.rows = 0
+
+    def write(self, chunk):
+        name, frame = chunk_to_frame(chunk)
+        names = [str(column) for column in frame.columns]
+        if names != list(frame.columns):
+            frame = frame.set_axis(names, axis=1)
+
+        sheet = self.sheets.get(name)
+        if sheet is None:
+            sheet = self.sheets[name] = _SheetPart(name)
+        sheet.add_columns(frame)
+        sheet.frames.append(frame)
+        self.rows += len(frame)
+        self.staged += int(frame.memory_usage(index=False, deep=True).sum())
+        if self.staged > self.spool_memory or self.spill.budget.exceeded():
+            self._spill()
+
+    @property
+    def spilled(self):
+        return self.spill.bytes
+
+    @property
+    def close_work(self):
+        """关闭时需要生成的行数（全部暂存的行）"""
+        return self.rows
+
+    @property
+    def layout(self):
+        """各逻辑工作表实际写出的工作表名（含续写的分页）"""
+        return {name: sheet.titles for name, sheet in self.sheets.items()}
+
+    def _spill(self):
+        """把内存中暂存的数据块写入各工作表的列式临时文件"""
+        for sheet in self.sheets.values():
+            if not sheet.frames:
+                continue
+            if sheet.spool is None:
+                fd, sheet.path = tempfile.mkstemp(suffix='.fmac', dir=self.spill.path())
+                sheet.spool = os.fdopen(fd, 'wb')
+            for frame in sheet.frames:
+                self.spill.bytes += write_columnar(sheet.spool, Chunk('table', None, frame, sheet.name))
+            sheet.frames = []
+            sheet.spool.flush()
+        self.staged = 0
+
+    def _write_sheet(self, sheet, check=None):
+        """按统一表头与列类型写出一个工作表的全部暂存数据（先读回溢写的部分）"""
+        spilled = ()
+        if sheet.spool is not None:
+            sheet.spool.close()
+            spilled = (chunk.data for chunk in iter_columnar(sheet.path))
+        # 来源信息列始终放在最后
+        header = [c for c in sheet.header if c not in SOURCE_COLUMNS]
+        header = (header + [c for c in SOURCE_COLUMNS if c in sheet.columns])[:EXCEL_MAX_COLUMNS]
+        dtypes = {column: resolve_dtype(sheet.dtypes.get(column, ())) for column in header}
+        self._open_part(sheet, header)
+        frames, sheet.frames = sheet.frames, []
+        for frame in itertools.chain(spilled, frames):
+            if check:
+                check(len(frame))
+            frame = clean_excel_cells(align_frame(frame, header, dtypes))
+            rows = frame_rows(frame)
+            remaining = len(frame)
+            while remaining:
+                space = self.max_rows - sheet.rows
+                if space <= 0:
+                    self._open_part(sheet, header)
+                    continue
+                count = min(space, remaining)
+                for _ in range(count):
+                    sheet.ws.append(next(rows))
+                sheet.rows += count
+                remaining -= count
+
+    def _open_part(self, sheet, header):
+        """为工作表创建新的分页并写入表头"""
+        sheet.part += 1
+        title = sheet.name if sheet.part == 1 else f'{sheet.name}_{sheet.part}'
+        sheet.ws = self.workbook.create_sheet(sheet_title(title, self.titles))
+        sheet.titles.append(sheet.ws.title)
+        sheet.ws.append(header)
+        sheet.rows = 1
+
+    def close(self, check=None):
+        """写出全部工作表；check(rows) 在每个暂存数据块前调用，可抛出 MergeCancelled 中止"""
+        try:
+            for sheet in self.sheets.values():
+                self._write_sheet(sheet, check)
+            if not self.sheets:
+                self.workbook.create_sheet(DEFAULT_SHEET)
+            self.workbook.save(self.output_file)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """释放暂存数据，不生成输出"""
+        for sheet in self.sheets.values():
+            if sheet.spool is not None:
+                sheet.spool.close()
+        # 生成中途中止时，结束已创建的只写工作表并删除 openpyxl 的临时文件
+        for ws in self.workbook.worksheets:
+            if not ws.closed:
+                ws.close()
+                ws._writer.cleanup()
+        self.spill.cleanup()
+
+
+class _SheetPart:
+    """ExcelWriter 中单个逻辑工作表的写入状态"""
+    __slots__ = ('name', 'header', 'columns', 'dtypes', 'frames', 'path', 'spool', 'ws', 'rows', 'part', 'titles')
+
+    def __init__(self, name):
+        self.name = name
+        self.header = []
+        self.columns = set()
+        self.dtypes = {}
+        self.frames = []
+        self.path = None
+        self.spool = None
+        self.ws = None
+        self.rows = 0
+        self.part = 0
+        self.titles = []
+
+    def add_columns(self, frame):
+        """把新出现的列追加到统一表头，并记录各列（非空时）的类型"""
+        for column in frame.columns:
+            if column not in self.columns:
+                self.columns.add(column)
+                self.header.append(column)
+        present = frame.notna().any()
+        for column, dtype in frame.dtypes.items():
+            if present[column]:
+                self.dtypes.setdefault(column, set()).add(dtype)
+
+
+def resolve_dtype(dtypes):
+    """确定一列的最终类型：各块类型相同则沿用，都是数值时取公共类型，否则为 object"""
+    import numpy as np
+
+    dtypes = list(dtypes)
+    if not dtypes:
+        return None
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return dtypes[0]
+    if all(isinstance(dtype, np.dtype) and dtype.kind in 'iuf' for dtype in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype(object)
+
+
+def align_frame(frame, header, dtypes=None):
+    """按统一表头重排列（缺少的列为空值），并转换为最终确定的列类型"""
+    if list(frame.columns) != header:
+        frame = frame.reindex(columns=header)
+    for column, dtype in (dtypes or {}).items():
+        if dtype is not None and frame[column].dtype != dtype:
+            try:
+                frame[column] = frame[column].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+    return frame
+
+
+def clean_excel_cells(frame):
+    """去除 Excel 不允许的控制字符，并截断超长文本"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    cleaned = None
+    for column in frame.columns[[_is_text_dtype(t) for t in frame.dtypes]]:
+        values = frame[column]
+        try:
+            text = values.str
+        except AttributeError:  # 对象列中没有字符串
+            continue
+        bad = text.contains(ILLEGAL_CHARACTERS_RE, na=False) | (text.len() > EXCEL_MAX_CELL_CHARS)
+        if bad.any():
+            if cleaned is None:
+                cleaned = frame.copy()
+            values = values.astype(object)
+            values[bad] = values[bad].str.replace(ILLEGAL_CHARACTERS_RE, '', regex=True).str[:EXCEL_MAX_CELL_CHARS]
+            cleaned[column] = values
+    return frame if cleaned is None else cleaned
+
+
+def excel_cell_text(text):
+    """单个文本按 clean_excel_cells 的规则清理"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    return ILLEGAL_CHARACTERS_RE.sub('', text)[:EXCEL_MAX_CELL_CHARS]
+
+
+def _is_text_dtype(dtype):
+    """对象列、字符串列或分类列"""
+    import pandas as pd
+
+    return dtype == object or isinstance(dtype, (pd.StringDtype, pd.CategoricalDtype))
+
+
+class TextWriter:
+    """文本输出：表格按 CSV 写出，文本按行写出
+
+    直接追加写入，支持按字节偏移量提交/回滚，断点续传时截断到最后提交点。
+    """
+    resumable = True
+
+    def __init__(self, output_file, settings, resume=None):
+        self.settings = settings
+        self.add_source = settings.get('add_source', False)
+        self.last_source = None
+        self.last_header = None
+        self.rows = 0
+        if resume is None:
+            self.file = open(output_file, 'w', encoding='utf-8', newline='')
+        else:
+            self.file = open(output_file, 'r+', encoding='utf-8', newline='')
+            self.file.seek(resume['offset'])
+            self.file.truncate()
+            self._restore(resume)
+        self.csv = csv.writer(self.file)
+        self.committed = self.commit()
+
+    def write(self, chunk):
+        if self.add_source and chunk.kind != 'table' and chunk.source != self.last_source:
+            self.file.write(f'===== 来源: {chunk.source} =====\n')
+        self.last_source = chunk.source
+
+        if chunk.kind == 'raw':
+            self._write_raw(chunk)
+            return
+        if chunk.kind == 'table':
+            header = (chunk.sheet, tuple(chunk.data.columns))
+            if header != self.last_header:
+                self.csv.writerow(header[1])
+                self.last_header = header
+            self.csv.writerows(frame_rows(chunk.data))
+        else:
+            self.last_header = None
+            if chunk.kind == 'text':
+                lines = chunk.data
+            elif chunk.kind == 'doc':
+                lines = [text for text, _ in chunk.data]
+            else:
+                lines = [json.dumps(r, ensure_ascii=False, default=str) for r in json_items(chunk)]
+            self.file.write('\n'.join(lines))
+            self.file.write('\n')
+        self.rows += len(chunk)
+
+    def _write_raw(self, chunk):
+        """原始字节直接追加到输出文件，缺少结尾换行时补上
+
+        拷贝时发现内容不是合法的 UTF-8（编码识别只看了采样）时，截断已写入
+        的部分，改为逐行解码读取该文件后写入。
+        """
+        start, end, header, header_line = chunk.data
+        self.file.flush()
+        position, last_header = self.file.tell(), self.last_header
+        if header is None:
+            self.last_header = None
+        elif (chunk.sheet, tuple(header)) != self.last_header:
+            # 原样写出表头行，与后面直接拷贝的数据行使用相同的换行符
+            self.file.write(header_line)
+            self.last_header = (chunk.sheet, tuple(header))
+        self.file.flush()
+        try:
+            lines, last = append_bytes(chunk.source, start, end, self.file.fileno())
+        except UnicodeDecodeError:
+            self.file.seek(position)
+            self.file.truncate()
+            self.last_header = last_header
+            for decoded in iter_file_chunks(chunk.source, self.settings):
+                self.write(decoded)
+            return
+        # 文件描述符的位置已在外部移动，重新定位到末尾
+        self.file.seek(0, os.SEEK_END)
+        if last is not None and last != b'\n':
+            self.file.write('\n')
+            lines += 1
+        self.rows += lines
+
+    def commit(self):
+        """刷新到磁盘，返回当前提交点（字节偏移量与写入状态）"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.committed = {
+            'offset': self.file.tell(),
+            'rows': self.rows,
+            'last_source': self.last_source,
+            'last_header': list(self.last_header) if self.last_header else None,
+        }
+        return self.committed
+
+    def rollback(self):
+        """丢弃最后提交点之后写入的内容"""
+        self.file.flush()
+        self.file.seek(self.committed['offset'])
+        self.file.truncate()
+        self._restore(self.committed)
+
+    def _restore(self, state):
+        self.rows = state['rows']
+        self.last_source = state['last_source']
+        header = state['last_header']
+        self.last_header = (header[0], tuple(header[1])) if header else None
+
+    def close(self, check=None):
+        self.file.close()
+
+    def discard(self):
+        """关闭并删除未写完的输出"""
+        self.file.close()
+        os.remove(self.file.name)
+
+
+def chunk_records(chunk):
+    """数据块转换为 JSON 输出的元素列表：表格每行一个对象，段落为文本"""
+    if chunk.kind == 'table':
+        return [dict(zip(chunk.data.columns, row)) for row in frame_rows(chunk.data)]
+    if chunk.kind == 'doc':
+        return [text for text, _ in chunk.data]
+    return json_items(chunk)
+
+
+class JsonWriter:
+    """JSON 输出：数组元素依次写出，对象深度合并
+
+    深度合并的结果在关闭时才能写出。进程超过内存预算后，之后到达的对象
+    不再合并到内存中，而是按顺序序列化到输出旁的临时目录，关闭时逐个读回
+    并按原顺序合并（深度合并在类型冲突时与分组方式有关，只能依次合并）。
+    合并过程中内存不随输入增长，但最终的合并结果仍需完整放入内存才能写出。
+    """
+
+    def __init__(self, output_file, settings):
+        self.file = open(output_file, 'w', encoding='utf-8')
+        self.spill = SpillDir(output_file, settings)
+        self.objects = None
+        self.merged = None
+        self.count = 0
+        self.rows = 0
+
+    @property
+    def spilled(self):
+        return self.spill.bytes
+
+    def write(self, chunk):
+        if chunk.kind == 'object':
+            self._merge(chunk.data)
+            self.rows += 1
+            return
+        items = chunk_records(chunk)
+        for item in items:
+            self.file.write('[\n' if self.count == 0 else ',\n')
+            self.file.write(JSON_ENCODER.encode(item))
+            self.count += 1
+        self.rows += len(items)
+
+    def _merge(self, data):
+        if self.objects is None and self.spill.budget.exceeded():
+            fd, path = tempfile.mkstemp(suffix='.pickle', dir=self.spill.path())
+            self.objects = os.fdopen(fd, 'w+b')
+        if self.objects is None:
+            self.merged = deep_merge(self.merged or {}, data)
+        else:
+            start = self.objects.tell()
+            pickle.dump(data, self.objects, protocol=pickle.HIGHEST_PROTOCOL)
+            self.spill.bytes += self.objects.tell() - start
+
+    def close(self, check=None):
+        try:
+            if self.objects is not None:
+                # 依次合并溢写的对象
+                self.objects.seek(0)
+                while True:
+                    if check:
+                        check()
+                    try:
+                        data = pickle.load(self.objects)
+                    except EOFError:
+                        break
+                    self.merged = deep_merge(self.merged or {}, data)
+            if self.count:
+                if self.merged is not None:
+                    self.file.write(',\n' + json.dumps(self.merged, ensure_ascii=False, default=str))
+                self.file.write('\n]\n')
+            else:
+                json.dump(self.merged if self.merged is not None else [], self.file,
+                          ensure_ascii=False, indent=2, default=str)
+            self.file.close()
+        except BaseException:
+            self.discard()
+            raise
+        self._cleanup()
+
+    def discard(self):
+        """关闭并删除未写完的输出"""
+        self.file.close()
+        os.remove(self.file.name)
+        self._cleanup()
+
+    def _cleanup(self):
+        if self.objects is not None:
+            self.objects.close()
+            self.objects = None
+        self.spill.cleanup()
+
+
+class JsonLinesWriter:
+    """JSON Lines 输出：每个元素一行直接追加，不需要在结束时组装整个数组
+
+    顶层对象不做深度合并，每个对象各占一行，内存占用与输出大小无关。支持
+    按字节偏移量提交/回滚，断点续传时截断到最后提交点。
+    """
+    resumable = True
+
+    def __init__(self, output_file, settings, resume=None):
+        if resume is None:
+            self.file = open(output_file, 'wb')
+            self.rows = 0
+        else:
+            self.file = open(output_file, 'r+b')
+            self.file.seek(resume['offset'])
+            self.file.truncate()
+            self.rows = resume['rows']
+        self.committed = self.commit()
+
+    def write(self, chunk):
+        items = chunk_records(chunk)
+        encode = JSON_ENCODER.encode
+        self.file.write(''.join(encode(item) + '\n' for item in items).encode('utf-8'))
+        self.rows += len(items)
+
+    def tell(self):
+        return self.file.tell()
+
+    def commit(self):
+        """刷新到磁盘，返回当前提交点"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.committed = {'offset': self.file.tell(), 'rows': self.rows}
+        return self.committed
+
+    def rollback(self):
+        """丢弃最后提交点之后写入的内容"""
+        self.file.seek(self.committed['offset'])
+        self.file.truncate()
+        self.rows = self.committed['rows']
+
+    def close(self, check=None):
+        self.file.close()
+
+    def discard(self):
+        """关闭并删除未写完的输出"""
+        self.file.close()
+        os.remove(self.file.name)
+
+
+class WordWriter:
+    """Word 输出：正文按 XML 流式合并，不在内存中构建整个文档
+
+    以 python-docx 的默认模板为基础包。.docx 输入（'docx' 数据块）的
+    word/document.xml 用 iterparse 逐个读取正文顶层元素，改写引用后追加到
+    输出旁的临时文件，读完即释放；每个文档末尾的节属性作为分节符保留页面
+    设置。样式按 styleId 合并，同名样式以先出现的为准（与 Word 插入文件时
+    "使用目标样式"一致）；编号定义按内容哈希去重，图片按内容哈希只存一份，
+    超链接按目标去重。其他数据块转换为纯文本段落。关闭时拼接 document.xml
+    并写出样式、编号、关系等部件。页眉页脚、脚注、尾注与批注不合并。
+    """
+
+    def __init__(self, output_file, settings):
+        from docx import Document
+        from lxml import etree
+
+        self.output_file = output_file
+        self.add_source = settings.get('add_source', False)
+        self.last_source = None
+        self.rows = 0
+
+        buffer = io.BytesIO()
+        Document().save(buffer)
+        with zipfile.ZipFile(buffer) as template:
+            self.template = {name: template.read(name) for name in template.namelist()
+                             if name not in WORD_DROPPED_PARTS}
+        root = etree.fromstring(self.template['word/document.xml'])
+        body = root.find(W + 'body')
+        self.namespaces = dict(root.nsmap)
+        self.ignorable = root.get(MC + 'Ignorable', '').split()
+        self.section = body.find(W + 'sectPr')
+        self.pending_section = None
+
+        self.styles = etree.fromstring(self.template['word/styles.xml'])
+        self.style_ids = set()
+        self.style_names = {}
+        self.style_parts = set()
+        for style in self.styles.iterfind(W + 'style'):
+            self._add_style(style)
+
+        self.abstract_nums = []
+        self.abstract_ids = {}
+        self.nums = []
+        self.numbering = etree.fromstring(self.template['word/numbering.xml'])
+        self._merge_numbering(self.numbering)
+        for child in list(self.numbering):
+            self.numbering.remove(child)
+
+        self.relationships = []
+        self.media = {}
+        self.links = {}
+        self.media_types = set()
+        self.drawing_id = 0
+        self.bookmark_id = 0
+        self.declarations = {}
+
+        self.zip = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED)
+        self.body = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(output_file)))
+
+    def write(self, chunk):
+        self._end_section()
+        if self.add_source and chunk.source != self.last_source:
+            self._paragraph(f'来源: {chunk.source}', bold=True)
+        self.last_source = chunk.source
+
+        if chunk.kind == 'docx':
+            self._write_docx(chunk.data)
+        elif chunk.kind == 'doc':
+            for text, style in chunk.data:
+                self._paragraph(text, style=self.style_names.get((style or '').lower()))
+        elif chunk.kind == 'table':
+            self._paragraph('\t'.join(map(str, chunk.data.columns)))
+            for row in frame_rows(chunk.data):
+                self._paragraph('\t'.join('' if v is None else str(v) for v in row))
+        elif chunk.kind == 'text':
+            for line in chunk.data:
+                self._paragraph(line)
+        else:
+            for record in json_items(chunk):
+                self._paragraph(json.dumps(record, ensure_ascii=False, default=str))
+
+    def _paragraph(self, text, style=None, bold=False):
+        """写入纯文本段落；制表符与换行转换为 w:tab 与 w:br"""
+        text = INVALID_XML_CHARS.sub('', str(text))
+        runs = '<w:br/>'.join(
+            '<w:tab/>'.join(f'<w:t xml:space="preserve">{xml_escape(part)}</w:t>' for part in line.split('\t'))
+            for line in text.split('\n'))
+        properties = f'<w:pPr><w:pStyle w:val="{xml_escape(style)}"/></w:pPr>' if style else ''
+        run_properties = '<w:rPr><w:b/></w:rPr>' if bold else ''
+        self.body.write(f'<w:p>{properties}<w:r>{run_properties}{runs}</w:r></w:p>'.encode('utf-8'))
+        self.rows += 1
+
+    def _end_section(self):
+        """上一个文档的节属性写成分节符，之后的内容另起一节"""
+        if self.pending_section is not None:
+            from lxml import etree
+
+            paragraph = etree.Element(W + 'p')
+            etree.SubElement(paragraph, W + 'pPr').append(deepcopy(self.pending_section))
+            self.body.write(self._serialize(paragraph))
+            # 之后的纯文本内容沿用该文档的页面设置
+            self.section = self.pending_section
+            self.pending_section = None
+
+    def _write_docx(self, path):
+        from lxml import etree
+
+        start = self.body.tell()
+        rows = self.rows
+        with zipfile.ZipFile(path) as package:
+            names = set(package.namelist())
+            relationships = self._merge_relationships(package, names)
+            numbers = {}
+            if 'word/numbering.xml' in names:
+                numbers = self._merge_numbering(etree.fromstring(package.read('word/numbering.xml')))
+            # 同一模板生成的文档样式部件相同，合并过的不必再解析
+            styles = package.read('word/styles.xml') if 'word/styles.xml' in names else None
+            digest = styles and hashlib.sha1(styles).digest()
+            if styles and digest not in self.style_parts:
+                self.style_parts.add(digest)
+                for style in list(etree.fromstring(styles).iterfind(W + 'style')):
+                    if style.get(W + 'styleId') not in self.style_ids:
+                        self._rewrite(style, relationships, numbers)
+                        self.styles.append(style)
+                        self._add_style(style)
+
+            bookmark_base = self.bookmark_id
+            body = None
+            section = None
+            try:
+                with package.open('word/document.xml') as f:
+                    for _, element in etree.iterparse(f, huge_tree=True):
+                        parent = element.getparent()
+                        if parent is None or parent.tag != W + 'body':
+                            continue
+                        if body is None:
+                            body = parent
+                            self._add_namespaces(parent.getparent())
+                        if element.tag == W + 'sectPr':
+                            section = element
+                            continue
+                        if element.tag not in WORD_DROPPED_ELEMENTS:
+                            bookmark_id = self._rewrite(element, relationships, numbers, bookmark_base)
+                            self.bookmark_id = max(self.bookmark_id, bookmark_id)
+                            self.body.write(self._serialize(element))
+                            self.rows += 1
+                        element.clear()
+                        while element.getprevious() is not None:
+                            del body[0]
+                if body is None:
+                    raise ValueError(f'不支持的 Word 文档: {path}')
+            except BaseException:
+                # 丢弃写了一半的正文，出错的文件不影响后续文件
+                self.body.seek(start)
+                self.body.truncate()
+                self.rows = rows
+                raise
+        if section is not None:
+            self._rewrite(section, relationships, numbers)
+            self.pending_section = section
+
+    def _rewrite(self, element, relationships, numbers, bookmark_base=0):
+        """改写元素中的关系 ID、编号 ID、绘图与书签 ID，返回遇到的最大书签 ID"""
+        removed = []
+        bookmark_id = self.bookmark_id
+        for node in element.iter():
+            tag = node.tag
+            if not isinstance(tag, str):
+                continue
+            if tag in WORD_DROPPED_ELEMENTS:
+                removed.append(node)
+                continue
+            for key, value in node.attrib.items():
+                if key.startswith(R):
+                    if value in relationships:
+                        node.set(key, relationships[value])
+                    else:
+                        embedded = _embedded_object(node)
+                        removed.append(node if embedded is None else embedded)
+            if tag == W + 'numId':
+                value = node.get(W + 'val')
+                node.set(W + 'val', numbers.get(value, '0'))
+            elif tag == WP + 'docPr':
+                self.drawing_id += 1
+                node.set('id', str(self.drawing_id))
+            elif tag in (W + 'bookmarkStart', W + 'bookmarkEnd'):
+                value = node.get(W + 'id')
+                if value is not None and value.isdigit():
+                    value = bookmark_base + int(value) + 1
+                    node.set(W + 'id', str(value))
+                    bookmark_id = max(bookmark_id, value)
+        for node in removed:
+            parent = node.getparent()
+            if node is element or parent is None:
+                continue
+            if node.tag in WORD_DROPPED_ELEMENTS or node.tag in WORD_EMBEDDED_OBJECTS:
+                parent.remove(node)
+            else:
+                for key in [key for key in node.attrib if key.startswith(R)]:
+                    del node.attrib[key]
+        return bookmark_id
+
+    def _serialize(self, element):
+        """序列化正文元素，去掉与根元素重复的命名空间声明
+
+        lxml 会在顶层元素上重复声明所有继承的命名空间；同一文档中这段声明
+        相同，处理结果按原文缓存。
+        """
+        from lxml import etree
+
+        data = etree.tostring(element, encoding='UTF-8', xml_declaration=False, with_tail=False)
+        block = XMLNS_BLOCK.match(data)
+        if block is None or not block.group(1):
+            return data
+        declarations = block.group(1)
+        stripped = self.declarations.get(declarations)
+        if stripped is None:
+            stripped = self.declarations[declarations] = XMLNS_PATTERN.sub(
+                lambda m: b'' if self.namespaces.get(m.group(1).decode()) == m.group(2).decode() else m.group(0),
+                declarations)
+        return data[:block.start(1)] + stripped + data[block.end(1):]
+
+    def _add_namespaces(self, root):
+        for prefix, uri in root.nsmap.items():
+            if prefix and prefix not in self.namespaces:
+                self.namespaces[prefix] = uri
+        for prefix in root.get(MC + 'Ignorable', '').split():
+            if prefix not in self.ignorable and root.nsmap.get(prefix) == self.namespaces.get(prefix):
+                self.ignorable.append(prefix)
+
+    def _add_style(self, style):
+        self.style_ids.add(style.get(W + 'styleId'))
+        name = style.find(W + 'name')
+        if name is not None:
+            self.style_names.setdefault(name.get(W + 'val', '').lower(), style.get(W + 'styleId'))
+
+    def _merge_numbering(self, root):
+        """合并编号定义，返回 {原 numId: 新 numId}
+
+        内容相同的 abstractNum 只保留一份（比较时忽略随机生成的 nsid）；
+        共用定义的列表在 Word 中会接续编号，因此为其添加从头开始的覆盖。
+        """
+        from lxml import etree
+
+        abstract_ids = {}
+        for node in root.iterfind(W + 'abstractNum'):
+            old = node.get(W + 'abstractNumId')
+            nsid = node.find(W + 'nsid')
+            if nsid is not None:
+                node.remove(nsid)
+            node.attrib.pop(W + 'abstractNumId', None)
+            key = hashlib.sha1(etree.tostring(node, method='c14n', exclusive=True)).hexdigest()
+            new = self.abstract_ids.get(key)
+            if new is None:
+                new = str(len(self.abstract_nums))
+                node.set(W + 'abstractNumId', new)
+                if nsid is not None:
+                    node.insert(0, nsid)
+                self.abstract_nums.append(node)
+                self.abstract_ids[key] = new
+                abstract_ids[old] = (new, None)
+            else:
+                level = node.find(W + 'lvl')
+                start = level.find(W + 'start') if level is not None else None
+                abstract_ids[old] = (new, start.get(W + 'val', '1') if start is not None else '1')
+
+        numbers = {}
+        for node in root.iterfind(W + 'num'):
+            reference = node.find(W + 'abstractNumId')
+            if reference is None or reference.get(W + 'val') not in abstract_ids:
+                continue
+            abstract, start = abstract_ids[reference.get(W + 'val')]
+            reference.set(W + 'val', abstract)
+            if start is not None and not any(o.get(W + 'ilvl') == '0' for o in node.iterfind(W + 'lvlOverride')):
+                override = etree.SubElement(node, W + 'lvlOverride', {W + 'ilvl': '0'})
+                etree.SubElement(override, W + 'startOverride', {W + 'val': start})
+            new = str(len(self.nums) + 1)
+            numbers[node.get(W + 'numId')] = new
+            node.set(W + 'numId', new)
+            self.nums.append(node)
+        return numbers
+
+    def _merge_relationships(self, package, names):
+        """复制图片并登记超链接，返回 {原关系 ID: 新关系 ID}"""
+        from lxml import etree
+
+        relationships = {}
+        if 'word/_rels/document.xml.rels' not in names:
+            return relationships
+        for rel in etree.fromstring(package.read('word/_rels/document.xml.rels')):
+            rel_type, target, external = rel.get('Type'), rel.get('Target'), rel.get('TargetMode') == 'External'
+            if rel_type == REL_HYPERLINK and external:
+                new = self.links.get(target)
+                if new is None:
+                    new = self.links[target] = self._add_relationship(REL_HYPERLINK, target, external=True)
+            elif rel_type == REL_IMAGE and not external:
+                part = target.lstrip('/') if target.startswith('/') else posixpath.normpath(f'word/{target}')
+                if part not in names:
+                    continue
+                data = package.read(part)
+                digest = hashlib.sha1(data).hexdigest()
+                new = self.media.get(digest)
+                if new is None:
+                    extension = posixpath.splitext(part)[1].lower() or '.bin'
+                    name = f'media/image{len(self.media) + 1}{extension}'
+                    self.zip.writestr(f'word/{name}', data)
+                    self.media_types.add(extension)
+                    new = self.media[digest] = self._add_relationship(REL_IMAGE, name)
+            else:
+                continue
+            relationships[rel.get('Id')] = new
+        return relationships
+
+    def _add_relationship(self, rel_type, target, external=False):
+        rel_id = f'rIdFmA{len(self.relationships) + 1}'
+        self.relationships.append((rel_id, rel_type, target, external))
+        return rel_id
+
+    def close(self, check=None):
+        from lxml import etree
+
+        try:
+            section = self.pending_section if self.pending_section is not None else self.section
+            declarations = ''.join(f' xmlns:{prefix}={quoteattr(uri)}' for prefix, uri in self.namespaces.items()
+                                   if prefix)
+            ignorable = f' mc:Ignorable="{" ".join(self.ignorable)}"' if self.ignorable else ''
+            with self.zip.open('word/document.xml', 'w', force_zip64=True) as f:
+                f.write(f"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+                        f'<w:document{declarations}{ignorable}><w:body>'.encode('utf-8'))
+                self.body.seek(0)
+                shutil.copyfileobj(self.body, f, RAW_COPY_BLOCK)
+                if section is not None:
+                    f.write(self._serialize(section))
+                f.write(b'</w:body></w:document>')
+
+            for node in self.abstract_nums + self.nums:
+                self.numbering.append(node)
+            rels = etree.fromstring(self.template['word/_rels/document.xml.rels'])
+            for rel in list(rels):
+                if rel.get('Target') in WORD_DROPPED_TARGETS:
+                    rels.remove(rel)
+            for rel_id, rel_type, target, external in self.relationships:
+                attributes = {'Id': rel_id, 'Type': rel_type, 'Target': target}
+                if external:
+                    attributes['TargetMode'] = 'External'
+                etree.SubElement(rels, PKG_REL + 'Relationship', attributes)
+            types = etree.fromstring(self.template['[Content_Types].xml'])
+            for node in list(types):
+                if node.get('PartName', '').lstrip('/') in WORD_DROPPED_PARTS:
+                    types.remove(node)
+            known = {node.get('Extension', '').lower() for node in types}
+            for extension in sorted(self.media_types):
+                if extension[1:] not in known:
+                    etree.SubElement(types, CONTENT_TYPES + 'Default', {
+                        'Extension': extension[1:],
+                        'ContentType': MEDIA_TYPES.get(extension, 'application/octet-stream')})
+
+            parts = dict(self.template)
+            parts.update({
+                'word/styles.xml': self.styles,
+                'word/numbering.xml': self.numbering,
+                'word/_rels/document.xml.rels': rels,
+                '[Content_Types].xml': types,
+            })
+            for name, part in parts.items():
+                if name == 'word/document.xml':
+                    continue
+                if not isinstance(part, bytes):
+                    part = etree.tostring(part, xml_declaration=True, encoding='UTF-8', standalone=True)
+                self.zip.writestr(name, part)
+        finally:
+            self.zip.close()
+            self.body.close()
+
+    def discard(self):
+        """关闭并删除未写完的输出"""
+        self.zip.close()
+        self.body.close()
+        os.remove(self.output_file)
+
+
+def _embedded_object(node):
+    """关系无法合并时需要整体移除的图形对象（绘图、VML 图形、OLE 对象）"""
+    for ancestor in itertools.chain([node], node.iterancestors()):
+        if ancestor.tag in WORD_EMBEDDED_OBJECTS:
+            return ancestor
+    return None
+
+
+WRITERS = {
+    'excel': ExcelWriter,
+    'word': WordWriter,
+    'json': JsonWriter,
+    'jsonl': JsonLinesWriter,
+    'text': TextWriter,
+}
+
+
+class JournalWriter:
+    """日志式写入器：数据块先顺序追加到输出旁的日志文件，全部完成后再生成输出
+
+    xlsx/docx/json 只能在结束时整体生成，断点续传时只需把日志截断到最后
+    提交点即可继续。
+    """
+
+    def __init__(self, writer_class, output_file, settings, resume=None):
+        self.writer_class = writer_class
+        self.output_file = output_file
+        self.settings = settings
+        self.path = output_file + JOURNAL_SUFFIX
+        self.spilled = 0
+        self.replayed = None
+        if resume is None:
+            self.file = open(self.path, 'wb')
+            self.rows = 0
+        else:
+            self.file = open(self.path, 'r+b')
+            self.file.truncate(resume['offset'])
+            self.file.seek(resume['offset'])
+            self.rows = resume['rows']
+        self.committed = self.commit()
+
+    def write(self, chunk):
+        pickle.dump(chunk, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.rows += len(chunk)
+
+    def commit(self):
+        """刷新日志到磁盘，返回当前提交点"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.committed = {'offset': self.file.tell(), 'rows': self.rows}
+        return self.committed
+
+    def rollback(self):
+        """丢弃最后提交点之后写入的数据块"""
+        self.file.seek(self.committed['offset'])
+        self.file.truncate()
+        self.rows = self.committed['rows']
+
+    def abort(self):
+        """中断时只关闭日志，保留续传所需的状态"""
+        self.file.close()
+
+    @property
+    def close_work(self):
+        """生成输出的行数，按日志中数据块的行数计（与 check(rows) 报告的单位一致）
+
+        回放日志即生成输出；目标写入器关闭时才生成的（如 Excel），回放只是
+        暂存，由目标写入器按同样的行数报告。关闭后 rows 改为目标写入器的行数
+        （如 Word 的段落数），这里仍返回回放的行数。
+        """
+        return self.rows if self.replayed is None else self.replayed
+
+    def close(self, check=None):
+        """按顺序回放日志生成最终输出，完成后删除日志
+
+        check(rows) 在每个数据块前调用；中止时删除未完成的输出，日志保留供续传。
+        """
+        self.file.close()
+        writer = self.writer_class(self.output_file, self.settings)
+        deferred = hasattr(writer, 'close_work')
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    try:
+                        chunk = pickle.load(f)
+                    except EOFError:
+                        break
+                    if check:
+                        check(0 if deferred else len(chunk))
+                    writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close(check)
+        self.replayed = self.rows
+        self.rows = writer.rows
+        self.spilled = getattr(writer, 'spilled', 0)
+        self.layout = getattr(writer, 'layout', {})
+        os.remove(self.path)
+
+
+def open_writer(output_format, output_file, settings, resumable=False, resume=None):
+    """创建输出写入器；需要断点续传时，不能直接续写的格式改用日志式写入"""
+    writer_class = WRITERS[output_format]
+    if not resumable:
+        return writer_class(output_file, settings)
+    if getattr(writer_class, 'resumable', False):
+        return writer_class(output_file, settings, resume=resume)
+    return JournalWriter(writer_class, output_file, settings, resume=resume)
+
+
+def deep_merge(base, other):
+    """深度合并两个字典：同名对象递归合并，同名数组追加，其余覆盖"""
+    for key, value in other.items():
+        current = base.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            deep_merge(current, value)
+        elif isinstance(current, list) and isinstance(value, list):
+            current.extend(value)
+        else:
+            base[key] = value
+    return base
+
+
+# ---------------------------------------------------------------------------
+# 列式中间文件
+# ---------------------------------------------------------------------------
+
+def write_columnar(f, chunk):
+    """把数据块以列式帧追加到文件
+
+    帧结构: 魔数 | 头部长度(8 字节) | 头部 JSON | 各列数据（按 64 字节对齐）。
+    数值/日期列保存原始 numpy 缓冲区，读取时可直接内存映射；其余列用 pickle。
+    返回写入的字节数。
+    """
+    import numpy as np
+    import pandas as pd
+
+    columns = []
+    blobs = []
+    if chunk.kind == 'table':
+        for name, series in chunk.data.items():
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # 分类列：编码按原始缓冲区保存，类别用 pickle 紧随其后
+                codes = np.ascontiguousarray(series.cat.codes.to_numpy())
+                blob = codes.tobytes()
+                blob += b'\0' * (_align(len(blob)) - len(blob))
+                blob += pickle.dumps(series.cat.categories.to_numpy(), protocol=pickle.HIGHEST_PROTOCOL)
+                columns.append({'name': str(name), 'dtype': codes.dtype.str, 'codes': codes.nbytes})
+                blobs.append(blob)
+                continue
+            values = series.to_numpy()
+            if values.dtype.kind in COLUMNAR_ARRAY_KINDS:
+                blob = np.ascontiguousarray(values).tobytes()
+                columns.append({'name': str(name), 'dtype': values.dtype.str})
+            else:
+                blob = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+                columns.append({'name': str(name), 'dtype': None})
+            blobs.append(blob)
+    else:
+        columns.append({'name': None, 'dtype': None})
+        blobs.append(pickle.dumps(chunk.data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    offset = 0
+    for column, blob in zip(columns, blobs):
+        column['offset'] = offset
+        column['size'] = len(blob)
+        offset += _align(len(blob))
+
+    header = json.dumps({
+        'kind': chunk.kind, 'source': chunk.source, 'sheet': chunk.sheet, 'position': chunk.position,
+        'rows': len(chunk), 'size': offset, 'columns': columns,
+    }, ensure_ascii=False).encode('utf-8')
+
+    start = f.tell()
+    f.write(COLUMNAR_MAGIC)
+    f.write(len(header).to_bytes(8, 'little'))
+    f.write(header)
+    f.write(b'\0' * (_align(f.tell()) - f.tell()))
+    for blob in blobs:
+        f.write(blob)
+        f.write(b'\0' * (_align(len(blob)) - len(blob)))
+    return f.tell() - start
+
+
+def iter_columnar(path, end=None, use_mmap=True):
+    """逐帧读取列式文件，end 限定只读取到该偏移量
+
+    use_mmap 时数值列直接引用内存映射的文件内容，不复制到内存。
+    """
+    import numpy as np
+    import pandas as pd
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size if end is None else end
+        if not size:
+            return
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read(size)
+
+    position = 0
+    while position < size:
+        if buffer[position:position + 4] != COLUMNAR_MAGIC:
+            raise ValueError(f'列式文件已损坏: {path}')
+        length = int.from_bytes(buffer[position + 4:position + 12], 'little')
+        header = json.loads(bytes(buffer[position + 12:position + 12 + length]).decode('utf-8'))
+        data_start = _align(position + 12 + length)
+
+        values = []
+        for column in header['columns']:
+            offset = data_start + column['offset']
+            if column.get('codes') is not None:
+                dtype = np.dtype(column['dtype'])
+                codes = np.frombuffer(buffer, dtype=dtype, offset=offset, count=column['codes'] // dtype.itemsize)
+                categories = pickle.loads(buffer[offset + _align(column['codes']):offset + column['size']])
+                values.append(pd.Categorical.from_codes(codes, categories))
+            elif column['dtype']:
+                dtype = np.dtype(column['dtype'])
+                values.append(np.frombuffer(buffer, dtype=dtype, offset=offset,
+                                            count=column['size'] // dtype.itemsize))
+            else:
+                values.append(pickle.loads(buffer[offset:offset + column['size']]))
+
+        if header['kind'] == 'table':
+            names = [column['name'] for column in header['columns']]
+            data = pd.DataFrame(dict(zip(names, values)), columns=names, copy=False)
+        else:
+            data = values[0]
+        yield Chunk(header['kind'], header['source'], data, header['sheet'], header.get('position'))
+        position = data_start + header['size']
+
+
+def _align(n):
+    return (n + COLUMNAR_ALIGN - 1) // COLUMNAR_ALIGN * COLUMNAR_ALIGN
+
+
+def _tee_columnar(chunks, f):
+    """逐块写入列式文件后再产出，返回原生成器的返回值"""
+    chunks = iter(chunks)
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as stop:
+            return stop.value
+        write_columnar(f, chunk)
+        yield chunk
+
+
+# ---------------------------------------------------------------------------
+# 增量合并
+# ---------------------------------------------------------------------------
+
+class IncrementalCache:
+    """增量合并缓存，保存在输出文件旁的 .fma-cache 目录
+
+    index.json 记录每个输入文件上次运行时的指纹，解析结果保存为列式中间文件。
+    再次运行时，未变化的文件直接回放缓存；只在末尾追加了内容的文本/日志文件
+    回放缓存后从上次的结束位置继续读取。
+    """
+
+    def __init__(self, output_file, settings):
+        self.dir = output_file + CACHE_SUFFIX
+        self.index_path = os.path.join(self.dir, 'index.json')
+        self.settings = settings
+        params = {k: settings.get(k) for k in READ_SETTINGS}
+        self.signature = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        self.index = {}
+        self.entries = {}
+        self.served = set()
+        self.hits = 0
+        self.appended = 0
+
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('signature') == self.signature:
+                self.index = data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+        os.makedirs(self.dir, exist_ok=True)
+
+    def prepare(self, path):
+        """返回可直接使用缓存的加载函数；需要重新解析时返回 None"""
+        is_text = os.path.splitext(path)[1].lower() in APPENDABLE_EXTENSIONS
+        entry = self.index.get(path)
+        if entry is not None and os.path.exists(self._cache_file(path)):
+            fingerprint = file_fingerprint(path)
+            if all(entry[key] == fingerprint[key] for key in fingerprint):
+                self.hits += 1
+                self.served.add(path)
+                return partial(self._replay, path, entry)
+            if is_text and self._is_appended(path, entry, fingerprint):
+                self.appended += 1
+                self.served.add(path)
+                return partial(self._read_text, path, entry)
+        if is_text:
+            # 文本在主进程读取，以便记录准确的结束位置
+            self.served.add(path)
+            return partial(self._read_text, path, None)
+        return None
+
+    def record(self, path, chunks):
+        """把重新解析的数据块写入缓存；由 prepare 提供的加载函数已自行缓存"""
+        if path in self.served:
+            return chunks
+        return self._record(path, chunks)
+
+    def _record(self, path, chunks):
+        fingerprint = file_fingerprint(path)
+        cache_file = self._cache_file(path)
+        with open(cache_file + '.tmp', 'wb') as f:
+            yield from _tee_columnar(chunks, f)
+            cache_size = f.tell()
+        os.replace(cache_file + '.tmp', cache_file)
+        self.entries[path] = dict(fingerprint, cache_size=cache_size)
+
+    def _replay(self, path, entry):
+        yield from iter_columnar(self._cache_file(path), entry['cache_size'])
+        self.entries[path] = entry
+
+    def _read_text(self, path, entry):
+        """回放已缓存的部分，再从上次结束位置读取追加的内容"""
+        cache_file = self._cache_file(path)
+        if entry is None:
+            start, encoding, mode = 0, None, 'wb'
+        else:
+            yield from iter_columnar(cache_file, entry['cache_size'])
+            start, encoding, mode = entry['end'], entry['encoding'], 'r+b'
+
+        encoding = encoding or detect_encoding(path)
+        with open(cache_file, mode) as f:
+            if entry is not None:
+                f.truncate(entry['cache_size'])
+                f.seek(entry['cache_size'])
+            end = yield from _tee_columnar(read_text(path, self.settings, start, encoding), f)
+            cache_size = f.tell()
+
+        fingerprint = file_fingerprint(path)
+        self.entries[path] = dict(fingerprint, cache_size=cache_size, end=end, encoding=encoding,
+                                  prefix=self._prefix_hash(path, end))
+
+    def _is_appended(self, path, entry, fingerprint):
+        """文件只在末尾追加：变大，且上次读到的结束位置之前的内容未变"""
+        # 上次结束在行中间时 prefix 为 None，追加内容会接在最后一行后面，需要整体重新读取
+        return ('end' in entry and entry.get('prefix') is not None and fingerprint['size'] > entry['end']
+                and self._prefix_hash(path, entry['end']) == entry['prefix'])
+
+    @staticmethod
+    def _prefix_hash(path, end):
+        """对 [0, end) 的开头与结尾采样哈希；end 前不是完整行时返回 None"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            f.seek(max(0, end - 1))
+            if end and f.read(1) != b'\n':
+                return None  # 最后一行没有换行符，追加内容可能接在该行后面
+            f.seek(0)
+            digest.update(f.read(min(end, FINGERPRINT_SAMPLE)))
+            f.seek(max(0, end - FINGERPRINT_SAMPLE))
+            digest.update(f.read(min(end, FINGERPRINT_SAMPLE)))
+        return digest.hexdigest()
+
+    def _cache_file(self, path):
+        name = hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=12).hexdigest()
+        return os.path.join(self.dir, name + '.fmac')
+
+    def save(self):
+        """写入新的索引，删除不再使用的缓存文件"""
+        keep = {os.path.basename(self._cache_file(path)) for path in self.entries}
+        for name in os.listdir(self.dir):
+            if name.endswith(('.fmac', '.tmp')) and name not in keep:
+                os.remove(os.path.join(self.dir, name))
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'files': self.entries}, f, ensure_ascii=False)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+
+# ---------------------------------------------------------------------------
+# 按时间戳外部排序
+# ---------------------------------------------------------------------------
+
+class TimeSorter:
+    """按时间戳对日志记录做外部归并排序，内存占用有上限
+
+    每个文本文件读取一遍：开头按时间有序的部分只记下字节范围，归并时再从原
+    文件读取；之后的乱序记录进入内存缓冲区，超过 sort_memory 字节时排序并
+    写成临时的有序段。最后对所有有序段做 k 路堆归并，有序段过多时先分批归
+    并，限制同时打开的文件数。没有时间戳的行（如堆栈信息）跟随上一条带时间
+    戳的行；时间相同的记录保持输入顺序。
+
+    settings 中的相关设置：
+        time_pattern  - 提取时间戳的正则表达式，有分组时取第一个分组
+        time_format   - 时间戳的 strptime 格式；不设置时按字符串比较（适用于 ISO 格式）
+        sort_memory   - 内存缓冲区上限（字节）
+    """
+
+    def __init__(self, output_file, settings):
+        self.pattern = re.compile(settings.get('time_pattern') or TIME_PATTERN)
+        self.time_format = settings.get('time_format')
+        self.memory = settings.get('sort_memory', SORT_MEMORY)
+        self.max_runs = max(2, settings.get('sort_max_runs', SORT_MAX_RUNS))
+        self.chunk_lines = settings.get('text_chunk_lines', TEXT_CHUNK_LINES)
+        self.output_dir = os.path.dirname(os.path.abspath(output_file))
+        self.prefix = os.path.basename(output_file) + SORT_SUFFIX
+        self.temp_dir = None
+        self.paths = []
+        self.runs = []
+        self.buffer = []
+        self.buffered = 0
+        self.spilled = 0
+
+    def prepare(self, path):
+        """文本文件交给排序器读取（用作 iter_sources 的 prepare）"""
+        if os.path.splitext(path)[1].lower() not in SORT_EXTENSIONS:
+            return None
+        return partial(self.add, path)
+
+    def add(self, path):
+        """读取一个文件，记录有序的开头部分并缓冲其余记录；内容在 chunks() 中产出"""
+        encoding = detect_encoding(path)
+        index = len(self.paths)
+        self.paths.append(path)
+        last = None
+        in_order = True
+        count = 0
+        end = 0
+        for key, offset, end, lines in self._records(path, encoding):
+            if in_order:
+                if last is None or key >= last:
+                    last = key
+                    count += 1
+                    continue
+                in_order = False
+                if offset is None:
+                    # 无法按字节定位（如 UTF-16）时整个文件进入缓冲区
+                    self._buffer_records(path, encoding, index)
+                    break
+                self.runs.append(('file', index, encoding, offset))
+            self._buffer_record((key, index, count, lines))
+            count += 1
+        if in_order and count:
+            self.runs.append(('file', index, encoding, end))
+        return ()
+
+    def _buffer_records(self, path, encoding, index):
+        for count, (key, _, _, lines) in enumerate(self._records(path, encoding)):
+            self._buffer_record((key, index, count, lines))
+
+    def _buffer_record(self, record):
+        self.buffer.append(record)
+        self.buffered += sum(len(line) + 64 for line in record[3]) + 128
+        if self.buffered >= self.memory:
+            self.buffer.sort()
+            self.runs.append(self._spill(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def _key(self, line):
+        """提取时间戳并转换为可比较的字符串，没有时间戳返回 None"""
+        match = self.pattern.search(line)
+        if match is None:
+            return None
+        text = match.group(1) if self.pattern.groups else match.group(0)
+        if self.time_format:
+            try:
+                return datetime.strptime(text, self.time_format).strftime('%Y-%m-%d %H:%M:%S.%f')
+            except ValueError:
+                return None
+        return text.replace('/', '-').replace('T', ' ').replace(',', '.')
+
+    def _records(self, path, encoding, end=None):
+        """逐条产出 (时间键, 起始字节偏移, 结束字节偏移, 行列表)
+
+        按字节读取以便记录偏移量；UTF-16/32 等不兼容 ASCII 的编码按文本读取，偏移量为 None。
+        """
+        if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+            key, lines = '', []
+            for chunk in read_text(path, {}, 0, encoding):
+                for line in chunk.data:
+                    current = self._key(line)
+                    if current is not None and lines:
+                        yield key, None, None, lines
+                        lines = []
+                    if current is not None:
+                        key = current
+                    lines.append(line)
+            if lines:
+                yield key, None, None, lines
+            return
+
+        key, lines, start, offset = '', [], 0, 0
+        with open(path, 'rb') as f:
+            for raw in f:
+                if end is not None and offset >= end:
+                    break
+                line = raw.decode(encoding, DECODE_ERRORS).rstrip('\r\n')
+                current = self._key(line)
+                if current is not None and lines:
+                    yield key, start, offset, lines
+                    lines = []
+                if not lines:
+                    start = offset
+                if current is not None:
+                    key = current
+                lines.append(line)
+                offset += len(raw)
+        if lines:
+            yield key, start, offset, lines
+
+    def _iter_run(self, run):
+        """按顺序读取一个有序段，产出 (时间键, 文件序号, 记录序号, 行列表)"""
+        if run[0] == 'file':
+            _, index, encoding, end = run
+            for count, (key, _, _, lines) in enumerate(self._records(self.paths[index], encoding, end)):
+                yield key, index, count, lines
+            return
+        with open(run[1], 'rb') as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    break
+                yield from batch
+        os.remove(run[1])
+
+    def _spill(self, records):
+        """把有序记录写入临时文件，返回有序段"""
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.mkdtemp(prefix=self.prefix, dir=self.output_dir)
+        fd, path = tempfile.mkstemp(suffix='.run', dir=self.temp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            records = iter(records)
+            while True:
+                batch = list(itertools.islice(records, 1024))
+                if not batch:
+                    break
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.spilled += f.tell()
+        return ('spill', path)
+
+    def chunks(self):
+        """按时间顺序产出文本数据块，连续来自同一文件的行合为一块"""
+        runs = self.runs
+        # 先分批归并，保证最终同时打开的有序段不超过 max_runs
+        while len(runs) + 1 > self.max_runs:
+            group, runs = runs[:self.max_runs], runs[self.max_runs:]
+            runs.append(self._spill(heapq.merge(*map(self._iter_run, group))))
+        self.buffer.sort()
+        streams = [self._iter_run(run) for run in runs] + [iter(self.buffer)]
+
+        batch = []
+        current = None
+        for _, index, _, lines in heapq.merge(*streams):
+            if index != current and batch:
+                yield Chunk('text', self.paths[current], batch)
+                batch = []
+            current = index
+            batch.extend(lines)
+            if len(batch) >= self.chunk_lines:
+                yield Chunk('text', self.paths[current], batch)
+                batch = []
+        if batch:
+            yield Chunk('text', self.paths[current], batch)
+        self.buffer = []
+
+    def cleanup(self):
+        """删除临时有序段"""
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+
+# ---------------------------------------------------------------------------
+# 断点续传
+# ---------------------------------------------------------------------------
+
+def file_fingerprint(path):
+    """文件指纹：大小、修改时间与内容哈希
+
+    小文件对全部内容做哈希，大文件对开头/中间/结尾各采样一段，避免为校验
+    重新读取整个文件。
+    """
+    st = os.stat(path)
+    digest = hashlib.blake2b(str(st.st_size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        if st.st_size <= FINGERPRINT_SAMPLE * 4:
+            for block in iter(partial(f.read, 1 << 20), b''):
+                digest.update(block)
+        else:
+            for offset in (0, st.st_size // 2, st.st_size - FINGERPRINT_SAMPLE):
+                f.seek(offset)
+                digest.update(f.read(FINGERPRINT_SAMPLE))
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': digest.hexdigest()}
+
+
+def merge_signature(input_path, output_file, settings):
+    """本次合并参数的签名；参数变化后旧的断点记录不再适用"""
+    params = {k: v for k, v in settings.items() if k not in RUNTIME_SETTINGS}
+    params['input'] = os.path.abspath(input_path)
+    params['output'] = os.path.abspath(output_file)
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class Checkpoint:
+    """断点续传清单，保存在输出文件旁（JSON Lines）
+
+    首行为合并参数签名，之后每处理完一个文件追加一行：路径、大小、修改时间、
+    内容哈希、写入行数、输出偏移量以及写入器状态。每行写入后立即落盘。
+    """
+
+    def __init__(self, output_file, signature):
+        self.path = output_file + CHECKPOINT_SUFFIX
+        self.signature = signature
+        self.file = None
+
+    def load(self):
+        """读取与本次参数一致的已提交记录"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break  # 中断时最后一行可能没有写完
+        if not entries or entries[0].get('signature') != self.signature:
+            return []
+        return entries[1:]
+
+    def open(self, entries):
+        """重写清单，只保留仍然有效的记录"""
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({'signature': self.signature}) + '\n')
+        for entry in entries:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def commit(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """合并完成后删除清单"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def resume_file_intact(output_format, output_file, offset):
+    """续传所需的文件（可续写格式为输出本身，其余为日志）仍存在且不短于最后提交点"""
+    if getattr(WRITERS[output_format], 'resumable', False):
+        path = output_file
+    else:
+        path = output_file + JOURNAL_SUFFIX
+    try:
+        return os.path.getsize(path) >= offset
+    except OSError:
+        return False
+
+
+def resumable_entries(entries, files):
+    """已提交记录中可以直接跳过的部分
+
+    文件按枚举顺序提交，因此记录必须与当前文件列表的前缀一致且内容未变。
+    """
+    for index, entry in enumerate(entries):
+        if index >= len(files) or entry['path'] != files[index]:
+            return entries[:index]
+        fingerprint = file_fingerprint(files[index])
+        if any(entry[key] != fingerprint[key] for key in fingerprint):
+            return entries[:index]
+    return entries
+
+
+# ---------------------------------------------------------------------------
+# 完整性校验
+# ---------------------------------------------------------------------------
+
+def canonical_value(value, excel=False):
+    """单元格/字段值的规范文本，写入与读回后的表示一致（空值为 None）
+
+    整数值的浮点数与整数视为相同（Excel 不区分），日期时间统一为 ISO 格式，
+    嵌套结构按排序键的 JSON 表示。excel 为 True 时按 Excel 写入器的处理
+    清理文本，日期按零点的日期时间比较。
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        # 不可打印字符（含控制字符）或超长时才需要清理
+        if excel and (len(value) > EXCEL_MAX_CELL_CHARS or not value.isprintable()):
+            return excel_cell_text(value)
+        return value
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer() and abs(value) < VERIFY_EXACT_FLOAT:
+            return str(int(value))
+        return repr(value)
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, datetime):
+        if value != value:  # NaT
+            return None
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return f'{value.isoformat()} 00:00:00' if excel else str(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    if hasattr(value, 'item'):  # numpy 标量
+        return canonical_value(value.item(), excel)
+    return str(value)
+
+
+def record_hash(record, excel=False):
+    """一条记录的 64 位哈希：对象按键排序（忽略空值），与字段顺序无关"""
+    if isinstance(record, dict):
+        pairs = []
+        for key, value in record.items():
+            value = canonical_value(value, excel)
+            if value is not None:
+                pairs.append(f'{key}\x1f{value}')
+        pairs.sort()
+        text = '\x1e'.join(pairs)
+    else:
+        text = canonical_value(record, excel) or ''
+    digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def digest_records(records, counts):
+    """按各来源的行数依次切分记录流，返回每段的 (行数, 校验和) 与多出的行数
+
+    校验和为记录哈希之和（模 2^64），与段内记录的顺序无关。
+    """
+    records = iter(records)
+    digests = []
+    for expected in counts:
+        rows = total = 0
+        for record in itertools.islice(records, expected):
+            total += record_hash(record)
+            rows += 1
+        digests.append((rows, total & VERIFY_MASK))
+    extra = sum(1 for _ in records)
+    return digests, extra
+
+
+def _read_excel_records(output_file, titles):
+    """读回一个逻辑工作表（可能分为多页）的数据行，每行按表头组成对象"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(output_file, read_only=True)
+    try:
+        for title in titles:
+            rows = workbook[title].iter_rows(values_only=True)
+            header = [str(name) if name is not None else '' for name in next(rows, ())]
+            for row in rows:
+                yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def _read_json_records(output_file, segment):
+    """读回 JSON 输出数组的元素；输出为单个对象时没有可校验的元素"""
+    with open(output_file, 'r', encoding='utf-8') as f:
+        stream = JsonStream(f)
+        if stream.peek() != '[':
+            return
+        stream.take('[')
+        if stream.peek() == ']':
+            return
+        while True:
+            yield stream.value()
+            if stream.take(',]') == ']':
+                break
+        stream.end()
+
+
+def _digest_jsonl(output_file, segment, counts):
+    """JSON Lines 输出按各来源写入时的字节范围读回，每个范围单独计算摘要
+
+    行数不一致只影响所在来源。tail 为 True 时还统计最后一个范围之后多出的行。
+    """
+    ranges, tail = segment
+    decode = json.JSONDecoder().decode
+    digests = []
+    extra = 0
+    with open(output_file, 'rb') as f:
+        for start, end in ranges + ([(ranges[-1][1] if ranges else 0, None)] if tail else []):
+            f.seek(start)
+            position = start
+            rows = total = 0
+            while end is None or position < end:
+                line = f.readline()
+                if not line:
+                    break
+                position += len(line)
+                if line.strip():
+                    total += record_hash(decode(line.decode('utf-8')))
+                    rows += 1
+            if end is None:
+                extra = rows
+            else:
+                digests.append((rows, total & VERIFY_MASK))
+    return digests, extra
+
+
+VERIFY_READERS = {
+    'excel': _read_excel_records,
+    'json': _read_json_records,
+}
+
+
+def verify_segment(output_format, output_file, segment, counts):
+    """读回输出的一段并计算各来源的摘要（在进程池中运行）"""
+    if output_format == 'jsonl':
+        return _digest_jsonl(output_file, segment, counts)
+    return digest_records(VERIFY_READERS[output_format](output_file, segment), counts)
+
+
+def _verify_result(future, job):
+    """取回校验结果；进程池异常退出时回退为主进程校验"""
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        return verify_segment(*job)
+
+
+def log_integrity(report, log):
+    """把校验报告写入日志，不一致的来源逐个列出"""
+    if report['verified'] is None:
+        log(f"完整性校验: {report['reason']}")
+        return
+    if report['verified']:
+        log(f"完整性校验通过: {report['files']} 个来源共 {report['rows']} 行，耗时 {report['seconds']:.1f} 秒")
+    else:
+        log(f"完整性校验未通过: {len(report['mismatches'])} 个来源不一致")
+        for item in report['mismatches'][:VERIFY_LOG_MISMATCHES]:
+            checksum = '一致' if item['checksum_ok'] else '不一致'
+            log(f"  {os.path.basename(item['file'])}: 应有 {item['expected_rows']} 行，"
+                f"实际 {item['actual_rows']} 行，校验和{checksum}")
+        if len(report['mismatches']) > VERIFY_LOG_MISMATCHES:
+            log(f"  ……另有 {len(report['mismatches']) - VERIFY_LOG_MISMATCHES} 个来源，见 stats['integrity']")
+        if report['extra_rows']:
+            log(f"  输出中多出 {report['extra_rows']} 行")
+    if report['unverified_objects']:
+        log(f"  {report['unverified_objects']} 个 JSON 顶层对象已深度合并，未逐个校验")
+
+
+class _TrackedWriter:
+    """在数据块交给写入器前记录摘要，其余属性与方法转发给原写入器"""
+
+    def __init__(self, writer, tracker):
+        self.writer = writer
+        self.tracker = tracker
+
+    def write(self, chunk):
+        self.tracker.record(chunk)
+        self.writer.write(chunk)
+        self.tracker.written(self.writer)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class IntegrityTracker:
+    """合并时按来源记录写入的行数与顺序无关的校验和，合并后读回输出核对
+
+    写入器收到的每条记录（经过筛选、添加来源列等处理之后）计算 64 位哈希并
+    累加，按 (来源, 输出位置) 分段记录；Excel 的位置为逻辑工作表，JSON Lines
+    另记录每段的字节范围。校验时输出只读一遍：各工作表或字节范围作为独立
+    任务并行读取，不重新读取任何输入文件。JSON Lines 按字节范围归属各来源；
+    Excel 与 JSON 按各段行数依次切分读回的记录，某个来源行数不一致时，同一
+    工作表中其后的来源也会显示为不一致。文本与 Word 输出混有表头行、来源
+    分隔行且原样拷贝字节，不支持校验。
+    """
+
+    def __init__(self, output_format):
+        self.output_format = output_format
+        self.excel = output_format == 'excel'
+        self.slots = []
+        self.last = {}
+        self.merged = 0
+        self.committed = (0, 0)
+        self.writer = None
+
+    @property
+    def supported(self):
+        return self.output_format in VERIFY_FORMATS
+
+    def wrap(self, writer):
+        self.writer = writer
+        return _TrackedWriter(writer, self) if self.supported else writer
+
+    def record(self, chunk):
+        if self.excel:
+            stream, frame = chunk_to_frame(chunk)
+            names = [str(column) for column in frame.columns]
+            records = (dict(zip(names, row)) for row in frame_rows(frame))
+        elif self.output_format == 'json' and chunk.kind == 'object':
+            self.merged += 1  # 顶层对象深度合并为一个元素，无法按来源核对
+            return
+        else:
+            stream, records = None, chunk_records(chunk)
+        slot = self.last.get(stream)
+        if slot is None or slot[0] != chunk.source:
+            start = self.writer.tell() if self.output_format == 'jsonl' else None
+            slot = [chunk.source, stream, 0, 0, start, start]
+            self.slots.append(slot)
+            self.last[stream] = slot
+        total = slot[3]
+        for record in records:
+            total += record_hash(record, self.excel)
+            slot[2] += 1
+        slot[3] = total & VERIFY_MASK
+
+    def written(self, writer):
+        if self.output_format == 'jsonl':
+            self.slots[-1][5] = writer.tell()
+
+    def commit(self):
+        """返回上次提交后新增的分段与合并对象数（写入断点清单）"""
+        slots, merged = self.committed
+        self.committed = (len(self.slots), self.merged)
+        self.last = {}
+        return {'slots': self.slots[slots:], 'merged': self.merged - merged}
+
+    def rollback(self):
+        del self.slots[self.committed[0]:]
+        self.merged = self.committed[1]
+        self.last = {}
+
+    def restore(self, entries):
+        """从断点清单恢复已提交文件的分段"""
+        for entry in entries:
+            state = entry.get('integrity') or {}
+            self.slots.extend(list(slot) for slot in state.get('slots', ()))
+            self.merged += state.get('merged', 0)
+        self.committed = (len(self.slots), self.merged)
+
+    def segments(self, workers):
+        """输出的校验任务：[(任务参数, 分段列表)]"""
+        if self.output_format == 'excel':
+            layout = getattr(self.writer, 'layout', {})
+            streams = {}
+            for slot in self.slots:
+                streams.setdefault(slot[1], []).append(slot)
+            return [(layout.get(stream, ()), slots) for stream, slots in streams.items()]
+        if self.output_format == 'json':
+            return [(None, self.slots)]
+        # JSON Lines：按字节数大致均分为 workers 段，分段边界落在来源之间
+        size = sum(slot[5] - slot[4] for slot in self.slots)
+        target = max(1, size // max(1, workers))
+        tasks, group = [], []
+        for slot in self.slots:
+            group.append(slot)
+            if group[-1][5] - group[0][4] >= target:
+                tasks.append(group)
+                group = []
+        if group or not tasks:
+            tasks.append(group)
+        return [(([(slot[4], slot[5]) for slot in group], group is tasks[-1]), group) for group in tasks]
+
+    def verify(self, output_file, workers=1):
+        """读回输出核对各来源的行数与校验和，返回校验报告"""
+        start = time.perf_counter()
+        if not self.supported:
+            return {'verified': None, 'reason': f'{self.output_format} 输出不支持完整性校验'}
+        tasks = self.segments(workers)
+        jobs = [(self.output_format, output_file, segment, [slot[2] for slot in slots])
+                for segment, slots in tasks]
+        pool = None
+        if workers > 1 and len(jobs) > 1:
+            try:
+                pool = ProcessPoolExecutor(min(workers, len(jobs)), mp_context=multiprocessing.get_context('spawn'))
+            except (OSError, ImportError, NotImplementedError, ValueError):
+                pool = None
+        if pool is None:
+            results = [verify_segment(*job) for job in jobs]
+        else:
+            with pool:
+                futures = [pool.submit(verify_segment, *job) for job in jobs]
+                results = [_verify_result(future, job) for future, job in zip(futures, jobs)]
+
+        files = {}
+        extra = 0
+        for (segment, slots), (digests, surplus) in zip(tasks, results):
+            extra += surplus
+            for slot, (rows, total) in zip(slots, digests):
+                item = files.setdefault(slot[0], {'file': slot[0], 'expected_rows': 0, 'actual_rows': 0,
+                                                  'checksum_ok': True})
+                item['expected_rows'] += slot[2]
+                item['actual_rows'] += rows
+                item['checksum_ok'] = item['checksum_ok'] and rows == slot[2] and total == slot[3]
+        if self.output_format == 'json' and self.merged and self.slots:
+            extra -= 1  # 数组末尾的深度合并对象
+        mismatches = [item for item in files.values()
+                      if not item['checksum_ok'] or item['expected_rows'] != item['actual_rows']]
+        return {
+            'verified': not mismatches and not extra,
+            'files': len(files),
+            'rows': sum(item['expected_rows'] for item in files.values()),
+            'mismatches': mismatches,
+            'extra_rows': extra,
+            'unverified_objects': self.merged,
+            'seconds': time.perf_counter() - start,
+        }
+
+
+# ---------------------------------------------------------------------------
+# 合并引擎
+# ---------------------------------------------------------------------------
+
+class FileMerger:
+    """文件合并引擎（分段流处理）
+
+    每个输入文件按块读取并立即交给输出写入器，内存占用与文件数量无关。
+    """
+
+    def merge_files(self, input_path, output_file, settings, log=None, file_processed=None, metrics=None,
+                    control=None):
+        """合并 input_path 下的文件到 output_file，返回 (success, stats)
+
+        metrics(dict) 按固定频率接收运行指标与按字节计算的进度（见 Telemetry），
+        最终指标也写入 stats['metrics']。file_processed(name, index) 每个文件
+        调用一次，界面显示进度应使用 metrics。
+
+        control（MergeControl）用于从其他线程暂停或取消。取消时进程池等待正在
+        解析的文件完成后关闭；启用断点续传时输出保留在最后提交点，再次运行
+        即可续传，否则删除不完整的输出。生成输出（如 Excel 写出暂存数据）期间
+        同样可以暂停或取消。
+
+        settings['verify'] 为 True 时合并后读回输出核对各来源的行数与校验和
+        （见 IntegrityTracker），报告写入 stats['integrity']，未通过时返回失败。
+        """
+        log = log or (lambda message: None)
+        control = control or MergeControl()
+        start = time.time()
+        telemetry = Telemetry(metrics, settings)
+        output_format = settings.get('output_format', 'excel')
+
+        if not os.path.exists(input_path):
+            return False, {'error': f'输入路径不存在: {input_path}'}
+        if output_format not in WRITERS:
+            return False, {'error': f'不支持的输出格式: {output_format}'}
+
+        # 边扫描边处理：先取到第一个文件再创建输出
+        files = scan_files(input_path, settings, exclude=[output_file], log=log)
+        first = next(files, None)
+        if first is None:
+            return False, {'error': '未找到可合并的文件'}
+        # 扫描在后台线程中继续，走完后即得到进度所需的输入总量
+        files = telemetry.scan(itertools.chain([first], files))
+
+        # 按时间排序时文本内容在全部读取后才写出，断点续传与增量缓存不适用
+        sorter = TimeSorter(output_file, settings) if settings.get('sort_by_time') else None
+        if sorter:
+            settings = dict(settings, resume=False, incremental=False)
+
+        # 筛选/统计阶段：与写入在同一遍读取中完成；有状态的阶段不支持断点续传
+        stages = build_stages(settings, output_file)
+        if not all(stage.resumable for stage in stages):
+            settings = dict(settings, resume=False)
+
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        os.makedirs(output_dir, exist_ok=True)
+
+        # 断点续传：跳过上次已提交的文件，输出截断到最后提交点。未指定时只对
+        # 可直接续写的格式（文本、JSON Lines）启用；其他格式续传需要把每个
+        # 数据块另写一份日志并在结束时回放，只在明确要求时使用
+        checkpoint = None
+        entries = []
+        resume_default = getattr(WRITERS[output_format], 'resumable', False)
+        if settings.get('resume') is None:
+            settings = dict(settings, resume=resume_default)
+        if settings['resume']:
+            checkpoint = Checkpoint(output_file, merge_signature(input_path, output_file, settings))
+            entries = checkpoint.load()
+            if entries and not resume_file_intact(output_format, output_file, entries[-1]['offset']):
+                log("断点记录对应的输出已被删除或截断，重新开始合并")
+                entries = []
+            prefix = list(itertools.islice(files, len(entries)))
+            entries = resumable_entries(entries, prefix)
+            telemetry.skip(prefix[:len(entries)])
+            files = itertools.chain(prefix[len(entries):], files)
+            if entries:
+                log(f"检测到未完成的合并，跳过已处理的 {len(entries)} 个文件")
+            checkpoint.open(entries)
+        done = len(entries)
+        resume = dict(entries[-1]['writer'], offset=entries[-1]['offset']) if entries else None
+
+        # 增量合并：未变化的文件读取上次的缓存
+        cache = IncrementalCache(output_file, settings) if settings.get('incremental') else None
+
+        # 文本输出：UTF-8 文本直接按字节拼接（增量合并需要解析结果写入缓存，不使用）
+        prepare = cache.prepare if cache else None
+        if sorter:
+            prepare = sorter.prepare
+        elif output_format == 'text' and not cache and not stages and settings.get('raw_copy', True):
+            prepare = partial(prepare_raw, settings=settings)
+        elif output_format == 'word' and not cache and not stages:
+            # Word 输出：.docx 正文由写入器按 XML 合并，不必解析为段落
+            prepare = prepare_docx
+
+        # 超过内存预算时，进程池的解析结果先写入临时目录
+        spill = SpillDir(output_file, settings)
+
+        writer = open_writer(output_format, output_file, settings, checkpoint is not None, resume)
+        # 完整性校验：写入时按来源记录行数与校验和，续传时从清单恢复已提交的部分
+        integrity = IntegrityTracker(output_format) if settings.get('verify') else None
+        if integrity:
+            integrity.restore(entries)
+            writer = integrity.wrap(writer)
+        telemetry.writer = writer
+        sources = iter_sources(files, settings, log, prepare, spill)
+        tagger = SourceTagger(output_format) if settings.get('add_source') else None
+        index = done
+        succeeded = sum(1 for entry in entries if entry['status'] == 'ok')
+        errors = [{'file': entry['path'], 'error': entry['error']}
+                  for entry in entries if entry['status'] != 'ok']
+        def cancelled():
+            return {
+                'error': '合并已取消',
+                'cancelled': True,
+                'resumable': checkpoint is not None,
+                'files': done + telemetry.files,
+                'output': output_file,
+                'metrics': telemetry.snapshot(),
+            }
+
+        telemetry.set_stage('读取')
+        try:
+            for index, (path, load) in enumerate(sources, done + 1):
+                name = os.path.basename(path)
+                before = writer.rows
+                error = None
+                file_start = time.perf_counter()
+                paused = telemetry.paused_seconds()
+                write_seconds = 0.0
+                try:
+                    control.check(telemetry)
+                    chunks = load()
+                    if cache:
+                        chunks = cache.record(path, chunks)
+                    for chunk in chunks:
+                        control.check(telemetry)
+                        write_start = time.perf_counter()
+                        write_chunk(writer, chunk, stages, tagger)
+                        write_seconds += time.perf_counter() - write_start
+                        telemetry.chunk_done(chunk)
+                    succeeded += 1
+                except MergeCancelled:
+                    raise
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    errors.append({'file': path, 'error': error})
+                    log(f"跳过 {name}: {e}")
+                    if checkpoint:
+                        writer.rollback()
+                        if integrity:
+                            integrity.rollback()
+                if checkpoint:
+                    state = dict(writer.commit())
+                    entry = dict(
+                        path=path, **file_fingerprint(path), rows=writer.rows - before,
+                        offset=state.pop('offset'), writer=state,
+                        status='failed' if error else 'ok', error=error,
+                    )
+                    if integrity:
+                        entry['integrity'] = integrity.commit()
+                    checkpoint.commit(entry)
+                if file_processed:
+                    file_processed(name, index)
+                seconds = time.perf_counter() - file_start - (telemetry.paused_seconds() - paused)
+                telemetry.file_done(path, writer.rows - before, seconds, write_seconds)
+            if sorter:
+                telemetry.set_stage('排序')
+                runs = len(sorter.runs)
+                for chunk in sorter.chunks():
+                    control.check(telemetry)
+                    write_chunk(writer, chunk, stages, tagger)
+                log(f"按时间排序: 归并 {runs} 个有序段，溢写 {sorter.spilled / 1024 / 1024:.1f} MB")
+            finish_stages(writer, stages)
+        except MergeCancelled:
+            sources.close()
+            if checkpoint:
+                # 丢弃当前文件已写入的部分，保留已提交的输出与清单供续传
+                writer.rollback()
+                getattr(writer, 'abort', writer.close)()
+                checkpoint.close()
+                log(f"已取消：{telemetry.files} 个文件已处理，再次运行将从中断处继续")
+            else:
+                writer.discard()
+                log("已取消：未生成输出")
+            spill.cleanup()
+            telemetry.set_stage('已取消')
+            return False, cancelled()
+        except BaseException:
+            # 异常中断：保留已提交的输出与清单，下次运行时续传；不续传时删除
+            # 不完整的输出，不把它当作正常结果生成
+            sources.close()
+            if checkpoint:
+                getattr(writer, 'abort', writer.close)()
+                checkpoint.close()
+            else:
+                writer.discard()
+            spill.cleanup()
+            raise
+        finally:
+            telemetry.stop()
+            if sorter:
+                sorter.cleanup()
+            for stage in stages:
+                if hasattr(stage, 'cleanup'):
+                    stage.cleanup()
+
+        sources.close()
+        telemetry.set_stage(OUTPUT_STAGE)
+
+        def generate(rows=0):
+            control.check(telemetry)
+            telemetry.generated(rows)
+
+        try:
+            writer.close(generate)
+        except MergeCancelled:
+            # 生成输出时取消：写入器已删除未完成的输出，日志式写入保留日志与清单
+            spill.cleanup()
+            if checkpoint:
+                checkpoint.close()
+                log("已取消：所有文件已处理，再次运行将直接生成输出")
+            else:
+                log("已取消：未生成输出")
+            telemetry.set_stage('已取消')
+            return False, cancelled()
+        # 写入器可能仍引用内存映射的溢写文件，关闭后再删除
+        spill.cleanup()
+        if checkpoint:
+            checkpoint.remove()
+        if cache:
+            cache.save()
+            log(f"增量合并: {cache.hits} 个文件未变化，{cache.appended} 个文件只读取追加内容")
+
+        dedup = next((stage for stage in stages if isinstance(stage, Deduplicator)), None)
+        if dedup:
+            log(f"去除重复行: 丢弃 {dedup.duplicates} 行")
+        spilled = spill.bytes + getattr(writer, 'spilled', 0)
+        if spilled:
+            log(f"超出内存预算，溢写到磁盘 {spilled / 1024 / 1024:.1f} MB")
+        log(f"共处理 {index} 个文件")
+        report = None
+        if integrity:
+            telemetry.set_stage('校验')
+            report = integrity.verify(output_file, max(1, int(settings.get('workers', 1) or 1)))
+            log_integrity(report, log)
+        telemetry.rows = writer.rows
+        telemetry.set_stage('完成')
+        stats = {
+            'time': time.time() - start,
+            'files': index,
+            'success': succeeded,
+            'failed': len(errors),
+            'rows': writer.rows,
+            'workers': settings.get('workers', 1),
+            'resumed': done,
+            'cached': cache.hits if cache else 0,
+            'appended': cache.appended if cache else 0,
+            'spilled': spilled,
+            'duplicates': dedup.duplicates if dedup else 0,
+            'output': output_file,
+            'errors': errors,
+            'metrics': telemetry.snapshot(),
+        }
+        if report:
+            stats['integrity'] = report
+        if not succeeded:
+            stats['error'] = '所有文件均处理失败'
+            return False, stats
+        if report and report['verified'] is False:
+            stats['error'] = '完整性校验未通过'
+            return False, stats
+        return True, stats
+
+
+# ---------------------------------------------------------------------------
+# 依赖检查与启动耗时
+# ---------------------------------------------------------------------------
+
+def missing_packages(packages=None):
+    """用 find_spec 检查依赖是否存在（不导入模块），返回缺失的 pip 包名"""
+    import importlib
+    import importlib.util
+
+    # 刚用 pip 安装的包也能被找到
+    importlib.invalidate_caches()
+    missing = []
+    for package, module in (packages or REQUIRED_PACKAGES).items():
+        try:
+            found = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
+            missing.append(package)
+    return missing
+
+
+def dependency_probe_key():
+    """依赖检查缓存的键：解释器路径、所需包列表与各 site-packages 目录的修改时间
+
+    pip 安装、升级或卸载包都会在 site-packages 中增删目录，从而改变其修改时间。
+    """
+    import site
+
+    paths = list(getattr(site, 'getsitepackages', lambda: [])())
+    if site.ENABLE_USER_SITE:
+        paths.append(site.getusersitepackages())
+    paths += [p for p in sys.path if os.path.basename(p) in ('site-packages', 'dist-packages')]
+    mtimes = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        if path not in mtimes:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+    return {
+        'executable': os.path.abspath(sys.executable),
+        'packages': REQUIRED_PACKAGES,
+        'site_packages': mtimes,
+    }
+
+
+def probe_dependencies(cache_file=DEPENDENCY_CACHE, refresh=False):
+    """检查依赖，结果缓存在磁盘上；环境未变化时直接返回上次的结果
+
+    返回缺失的 pip 包名列表。refresh 为真时忽略缓存重新检查（如安装依赖之后）。
+    """
+    key = dependency_probe_key()
+    if cache_file and not refresh:
+        try:
+            with open(cache_file, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['missing']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    missing = missing_packages()
+    if cache_file:
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            temp = cache_file + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'missing': missing}, f, ensure_ascii=False)
+            os.replace(temp, cache_file)
+        except OSError:
+            # 缓存只用于加速启动，无法写入时不影响使用
+            pass
+    return missing
+
+
+def measure_startup(module='fma_engine', runs=5):
+    """在新的解释器中导入模块并检查依赖，返回 (最短耗时, 启动时已加载的重型模块)"""
+    import subprocess
+
+    code = (
+        'import sys, time\n'
+        't = time.perf_counter()\n'
+        f'import {module}\n'
+        'import fma_engine\n'
+        'fma_engine.probe_dependencies()\n'
+        'print(time.perf_counter() - t)\n'
+        'print(",".join(m for m in fma_engine.HEAVY_MODULES if m in sys.modules))\n'
+    )
+    best, loaded = None, []
+    for _ in range(max(runs, 1)):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        elapsed, heavy = (result.stdout.splitlines() + [''])[:2]
+        best = min(best, float(elapsed)) if best is not None else float(elapsed)
+        loaded = heavy.split(',') if heavy else []
+    return best, loaded
+
+
+# ---------------------------------------------------------------------------
+# 命令行入口
+# ---------------------------------------------------------------------------
+
+def build_parser():
+    """命令行参数：python FmA.py merge --input ... --output ..."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='FmA.py', description='FmA 文件合并助手（命令行模式）')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    merge = commands.add_parser('merge', help='合并文件，结束时输出 JSON 格式的统计信息')
+    merge.add_argument('--input', '-i', required=True, help='输入文件或文件夹')
+    merge.add_argument('--output', '-o', required=True, help='输出文件路径')
+    merge.add_argument('--format', '-f', choices=sorted(WRITERS),
+                       help='输出格式，默认根据输出文件扩展名判断')
+    merge.add_argument('--recursive', dest='recursive', action='store_true', default=True,
+                       help='包含子文件夹（默认）')
+    merge.add_argument('--no-recursive', dest='recursive', action='store_false',
+                       help='不包含子文件夹')
+    merge.add_argument('--no-source', dest='add_source', action='store_false', default=True,
+                       help='不添加来源信息')
+    merge.add_argument('--workers', '-w', type=int, default=1, help='并行解析进程数，1 为串行')
+    merge.add_argument('--sheets', help='只读取这些工作表（逗号分隔）')
+    merge.add_argument('--columns', help='只读取这些列，表头名或列字母（逗号分隔）')
+    merge.add_argument('--include', help='只合并匹配的文件（glob，逗号分隔）')
+    merge.add_argument('--exclude', help='排除匹配的文件或目录（glob，逗号分隔）')
+    merge.add_argument('--incremental', action='store_true', help='增量合并，只重新读取变化的文件')
+    merge.add_argument('--resume', dest='resume', action='store_true', default=None,
+                       help='使用断点续传（Excel/JSON/Word 输出需额外写入日志，默认不使用）')
+    merge.add_argument('--no-resume', dest='resume', action='store_false',
+                       help='不使用断点续传（文本/JSON Lines 输出默认使用）')
+    merge.add_argument('--sort-by-time', action='store_true', help='文本/日志内容按时间戳排序')
+    merge.add_argument('--time-pattern', help='提取时间戳的正则表达式（有分组时取第一个分组）')
+    merge.add_argument('--time-format', help='时间戳的 strptime 格式，如 %%d/%%b/%%Y:%%H:%%M:%%S')
+    merge.add_argument('--sort-memory', type=int, help='排序使用的内存上限（MB）')
+    merge.add_argument('--levels', help='只保留这些级别的日志行，如 ERROR,FATAL（逗号分隔）')
+    merge.add_argument('--grep', dest='line_pattern', help='只保留匹配该正则表达式的文本行')
+    merge.add_argument('--ip-stats', action='store_true', help='统计文本行中的 IP 地址，结果附加在输出末尾')
+    merge.add_argument('--dedup', action='store_true', help='跨文件去除重复行（表格行、文本行与 JSON 元素）')
+    merge.add_argument('--dedup-columns', help='按这些列判断重复（逗号分隔），默认按整行')
+    merge.add_argument('--dedup-memory', type=int, help='去重索引使用的内存上限（MB），超出部分写入临时文件')
+    merge.add_argument('--memory-budget', type=int, help='内存预算（MB），超出后中间数据写入磁盘')
+    merge.add_argument('--strings', choices=['intern', 'category'],
+                       help='重复字符串的存储方式：intern 共用字符串对象，category 转为分类类型')
+    merge.add_argument('--no-raw-copy', dest='raw_copy', action='store_false', default=True,
+                       help='文本输出时逐行解码，不直接拼接 UTF-8 文件的原始字节')
+    merge.add_argument('--verify', action='store_true', help='合并后读回输出，按来源核对行数与校验和')
+    merge.add_argument('--quiet', '-q', action='store_true', help='不输出处理日志')
+
+    bench = commands.add_parser('bench-startup', help='测量冷启动耗时，超出预算或提前加载重型模块时返回 1')
+    bench.add_argument('--module', default='fma_engine', help='要导入的模块，界面为 FmA')
+    bench.add_argument('--runs', type=int, default=5, help='测量次数，取最短耗时')
+    bench.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='时间预算（秒）')
+    return parser
+
+
+def output_format_for(output_file):
+    """根据输出文件扩展名判断输出格式"""
+    ext = os.path.splitext(output_file)[1].lower()
+    for output_format, extensions in OUTPUT_EXTENSIONS.items():
+        if ext in extensions:
+            return output_format
+    return 'excel'
+
+
+def cli_main(argv=None):
+    """命令行入口：日志写到 stderr，统计信息以 JSON 写到 stdout；成功返回 0"""
+    args = build_parser().parse_args(argv)
+    if args.command == 'bench-startup':
+        return bench_startup(args)
+
+    settings = {
+        'add_source': args.add_source,
+        'recursive': args.recursive,
+        'combine_sheets': True,
+        'output_format': args.format or output_format_for(args.output),
+        'workers': args.workers,
+        'incremental': args.incremental,
+        'resume': args.resume,
+        'raw_copy': args.raw_copy,
+        'verify': args.verify,
+    }
+    for key in ('sheets', 'columns', 'include', 'exclude', 'sort_by_time', 'time_pattern', 'time_format',
+                'levels', 'line_pattern', 'ip_stats', 'strings', 'dedup', 'dedup_columns'):
+        if getattr(args, key):
+            settings[key] = getattr(args, key)
+    if args.memory_budget:
+        settings['memory_budget'] = args.memory_budget * 1024 * 1024
+    if args.sort_memory:
+        settings['sort_memory'] = args.sort_memory * 1024 * 1024
+    if args.dedup_memory:
+        settings['dedup_memory'] = args.dedup_memory * 1024 * 1024
+
+    def log(message):
+        if not args.quiet:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+    try:
+        success, stats = FileMerger().merge_files(args.input, args.output, settings, log=log)
+    except KeyboardInterrupt:
+        success, stats = False, {'error': '已中断，重新运行相同的命令可从断点继续'}
+    except Exception as e:
+        success, stats = False, {'error': str(e) or type(e).__name__}
+
+    print(json.dumps(dict(stats, ok=success), ensure_ascii=False, default=str))
+    return 0 if success else 1
+
+
+def bench_startup(args):
+    """冷启动基准：导入耗时不超过预算，且没有提前加载重型模块"""
+    elapsed, loaded = measure_startup(args.module, args.runs)
+    ok = elapsed <= args.budget and not loaded
+    print(json.dumps({'module': args.module, 'time': round(elapsed, 4), 'budget': args.budget,
+                      'heavy_modules': loaded, 'ok': ok}, ensure_ascii=False))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    # 以模块名重新导入，保证多进程传递的对象引用 fma_engine 而不是 __main__
+    from fma_engine import cli_main as _cli_main
+    sys.exit(_cli_main())
+
@@ -0,0 +1,148 @@
+"""合并引擎的基本测试：运行 python -m pytest -q"""
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import fma_engine
+from fma_engine import FileMerger, JsonStream, MergeControl, read_csv, read_json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ---------------------------------------------------------------------------
+# JsonStream 增量解析
+# ---------------------------------------------------------------------------
+
+JSON_VALUES = [
+    {'id': 1, 'name': '张三', 'tags': ['a', 'b'], 'nested': {'x': 1.5, 'y': None}},
+    {'id': 22, 'text': 'quote " backslash \\ newline \n tab \t', 'ok': True},
+    12345.678,
+    -0.5e-10,
+    'plain string',
+    [1, [2, [3, {}]], []],
+    {'big': 10 ** 30, 'empty': '', 'unicode': 'é😀'},
+]
+
+
+@pytest.mark.parametrize('block', [1, 2, 7, 64, 65536])
+def test_json_stream_round_trip(block):
+    """任意读取块大小下（值与数字在缓冲区边界被截断）解析结果与 json.loads 一致"""
+    text = json.dumps(JSON_VALUES, ensure_ascii=False, indent=1)
+    stream = JsonStream(io.StringIO(text), block)
+    stream.take('[')
+    values = []
+    while True:
+        values.append(stream.value())
+        if stream.take(',]') == ']':
+            break
+    stream.end()
+    assert values == json.loads(text)
+
+
+def test_read_json_chunks(tmp_path):
+    """顶层数组按元素分块产出，顶层对象整体产出"""
+    array = tmp_path / 'array.json'
+    array.write_text(json.dumps(JSON_VALUES, ensure_ascii=False), encoding='utf-8')
+    chunks = list(read_json(str(array), {'chunk_rows': 3, 'json_read_block': 5}))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [item for chunk in chunks for item in chunk.data] == JSON_VALUES
+
+    obj = tmp_path / 'object.json'
+    obj.write_text(json.dumps(JSON_VALUES[0], ensure_ascii=False), encoding='utf-8')
+    chunks = list(read_json(str(obj), {}))
+    assert [(chunk.kind, chunk.data) for chunk in chunks] == [('object', JSON_VALUES[0])]
+
+
+def test_json_stream_rejects_extra_data():
+    stream = JsonStream(io.StringIO('{"a": 1} {"b": 2}'), 4)
+    stream.value()
+    with pytest.raises(json.JSONDecodeError):
+        stream.end()
+
+
+# ---------------------------------------------------------------------------
+# CSV 列选择
+# ---------------------------------------------------------------------------
+
+def _projected(path, columns):
+    return [chunk.data.to_dict('list') for chunk in read_csv(path, {'columns': columns})]
+
+
+def test_csv_column_projection(tmp_path):
+    path = tmp_path / 'people.csv'
+    path.write_text('name,age,city\na,1,x\nb,2,y\n', encoding='utf-8')
+    path = str(path)
+    # 按表头名选择，输出顺序与设置一致
+    assert _projected(path, 'city,name') == [{'city': ['x', 'y'], 'name': ['a', 'b']}]
+    # 按列字母选择
+    assert _projected(path, 'B') == [{'age': [1, 2]}]
+    # 超出列数的列字母忽略，全部不存在时不产出数据块
+    assert _projected(path, 'name,D') == [{'name': ['a', 'b']}]
+    assert _projected(path, 'D,missing') == []
+
+
+# ---------------------------------------------------------------------------
+# 取消后断点续传
+# ---------------------------------------------------------------------------
+
+def _make_inputs(root):
+    os.makedirs(root)
+    for i in range(4):
+        with open(os.path.join(root, f'{i}_table.csv'), 'w', encoding='utf-8', newline='') as f:
+            f.write('编号,名称\n' + ''.join(f'{n},项目{i}-{n}\n' for n in range(200)))
+        with open(os.path.join(root, f'{i}_app.log'), 'w', encoding='utf-8') as f:
+            f.write(''.join(f'2023-01-01 12:00:{n:02d} INFO 日志 {i}-{n}\n' for n in range(50)))
+        with open(os.path.join(root, f'{i}_data.json'), 'w', encoding='utf-8') as f:
+            json.dump([{'id': n, 'file': i, 'v': [n, {'k': '值'}]} for n in range(30)], f, ensure_ascii=False)
+
+
+@pytest.mark.parametrize('output_format, name', [('jsonl', 'out.jsonl'), ('text', 'out.txt')])
+def test_resume_after_cancel_is_byte_identical(tmp_path, output_format, name):
+    """取消后再次运行从断点续传，输出与一次完成的合并逐字节相同"""
+    source = str(tmp_path / 'in')
+    _make_inputs(source)
+    settings = {'output_format': output_format, 'resume': True, 'add_source': False}
+
+    expected = str(tmp_path / ('full_' + name))
+    ok, stats = FileMerger().merge_files(source, expected, settings)
+    assert ok, stats
+
+    output = str(tmp_path / name)
+    control = MergeControl()
+
+    def file_processed(name, index):
+        if index == 5:
+            control.cancel()
+
+    ok, stats = FileMerger().merge_files(source, output, settings, file_processed=file_processed,
+                                         control=control)
+    assert not ok and stats['cancelled'] and stats['resumable']
+    assert os.path.exists(output + fma_engine.CHECKPOINT_SUFFIX)
+
+    ok, stats = FileMerger().merge_files(source, output, settings)
+    assert ok, stats
+    assert stats['resumed'] == 5
+    assert not os.path.exists(output + fma_engine.CHECKPOINT_SUFFIX)
+    with open(expected, 'rb') as f, open(output, 'rb') as g:
+        assert f.read() == g.read()
+
+
+# ---------------------------------------------------------------------------
+# 冷启动基准
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('module', ['fma_engine', 'FmA'])
+def test_bench_startup(module):
+    """bench-startup：导入耗时在预算内，且没有提前加载重型模块"""
+    if module == 'FmA' and importlib.util.find_spec('PyQt5') is None:
+        pytest.skip('未安装 PyQt5')
+    result = subprocess.run([sys.executable, os.path.join(HERE, 'FmA.py'), 'bench-startup', '--module', module],
+                            capture_output=True, text=True, cwd=HERE)
+    report = json.loads(result.stdout)
+    assert result.returncode == 0, report
+    assert report['ok'] and not report['heavy_modules']